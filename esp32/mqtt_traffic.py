@@ -0,0 +1,287 @@
+# MQTT traffic recorder / replayer - deterministic writer benchmarks
+#
+# Record live traffic to an append-only file:
+#   python mqtt_traffic.py record traffic.bin --broker localhost
+# Replay it to a broker at 1x, Nx or max speed:
+#   python mqtt_traffic.py replay traffic.bin --broker localhost --speed 10
+# Or feed it straight into MQTTWriterService.on_message (needs MONGODB_URI);
+# readings go to the "hydroponics_replay" database (--database), which is
+# emptied first unless --keep is given, and the anomaly detector starts
+# empty on every run:
+#   python mqtt_traffic.py replay traffic.bin --direct --speed max
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+from types import SimpleNamespace
+import paho.mqtt.client as mqtt
+
+RECORD_TOPICS = ["sensor/data/#", "status/#"]
+# Database the deployed writer uses; direct replays never write to it
+LIVE_DATABASE = "hydroponics"
+WRITER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "hidroponia-urbana", "backend", "minikube", "writer_api")
+
+# File format: MAGIC, then a stream of records.
+#   b"T" topic_id:u32 length:u16 name     - defines a topic the first time it is seen
+#   b"M" time:f64 topic_id:u32 length:u32 payload
+# Payloads are stored as received; topics are written once and then referenced by id.
+# Topic ids are u32: two topics per node would overflow u16 at ~32k nodes.
+MAGIC = b"HMQTTREC2\n"
+TOPIC_HEADER = struct.Struct("<IH")
+MESSAGE_HEADER = struct.Struct("<dII")
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class TrafficWriter:
+    """Appends MQTT messages to a recording file"""
+
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.topic_ids = {}
+        if not new_file:
+            # Continue an existing recording: reload its topic table and drop
+            # a torn last record so new records stay readable
+            reader = TrafficReader(path)
+            for topic_id, topic in reader.topics():
+                self.topic_ids[topic] = topic_id
+            os.truncate(path, reader.valid_length)
+        self.file = open(path, "ab")
+        if new_file:
+            self.file.write(MAGIC)
+        self.count = 0
+
+    def write(self, timestamp, topic, payload):
+        topic_id = self.topic_ids.get(topic)
+        if topic_id is None:
+            topic_id = len(self.topic_ids)
+            name = topic.encode("utf-8")
+            # Pack first so a topic that can't be stored is not registered
+            record = b"T" + TOPIC_HEADER.pack(topic_id, len(name)) + name
+            self.file.write(record)
+            self.topic_ids[topic] = topic_id
+        self.file.write(b"M" + MESSAGE_HEADER.pack(timestamp, topic_id, len(payload)) + payload)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class TrafficReader:
+    """Reads a recording; a truncated last record (e.g. after a crash) is ignored"""
+
+    def __init__(self, path):
+        self.path = path
+        # Bytes up to the end of the last complete record read so far
+        self.valid_length = 0
+
+    def _records(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not an MQTT traffic recording "
+                                 f"(or was made by an older version)")
+            self.valid_length = f.tell()
+            while True:
+                kind = f.read(1)
+                if kind == b"T":
+                    header = f.read(TOPIC_HEADER.size)
+                    if len(header) < TOPIC_HEADER.size:
+                        return
+                    topic_id, length = TOPIC_HEADER.unpack(header)
+                    name = f.read(length)
+                    if len(name) < length:
+                        return
+                    self.valid_length = f.tell()
+                    yield "T", topic_id, name.decode("utf-8")
+                elif kind == b"M":
+                    header = f.read(MESSAGE_HEADER.size)
+                    if len(header) < MESSAGE_HEADER.size:
+                        return
+                    timestamp, topic_id, length = MESSAGE_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        return
+                    self.valid_length = f.tell()
+                    yield "M", topic_id, (timestamp, payload)
+                else:
+                    return
+
+    def topics(self):
+        for kind, topic_id, value in self._records():
+            if kind == "T":
+                yield topic_id, value
+
+    def messages(self):
+        """Yield (timestamp, topic, payload) in recording order"""
+        topics = {}
+        for kind, topic_id, value in self._records():
+            if kind == "T":
+                topics[topic_id] = value
+            else:
+                timestamp, payload = value
+                yield timestamp, topics[topic_id], payload
+
+def record(args):
+    """Subscribe to the writer's topics and append everything to the file"""
+    writer = TrafficWriter(args.file)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            for topic in RECORD_TOPICS:
+                client.subscribe(topic, qos=1)
+            logger.info(f"Recording {', '.join(RECORD_TOPICS)} to {args.file}")
+        else:
+            logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
+
+    def on_message(client, userdata, msg):
+        writer.write(time.time(), msg.topic, msg.payload)
+        # Flush every message so a killed recorder loses at most one record
+        writer.flush()
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port, 60)
+
+    deadline = time.time() + args.duration if args.duration else None
+    client.loop_start()
+    try:
+        while deadline is None or time.time() < deadline:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+        logger.info(f"Recorded {writer.count} messages")
+
+def broker_sink(args):
+    """Return (deliver, close) publishing messages to a broker"""
+    client = mqtt.Client()
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+
+    last = None
+
+    def deliver(topic, payload):
+        nonlocal last
+        last = client.publish(topic, payload, qos=args.qos)
+
+    def close():
+        # publish() only queues; wait until the last message has left the
+        # client so nothing is dropped and the reported rate is the delivery rate
+        if last is not None:
+            last.wait_for_publish()
+        client.loop_stop()
+        client.disconnect()
+
+    return deliver, close
+
+def writer_sink(args):
+    """Return (deliver, close) calling MQTTWriterService.on_message directly"""
+    if args.database == LIVE_DATABASE:
+        raise SystemExit(f"Refusing to replay into the live '{LIVE_DATABASE}' database")
+    # writer_service reads its configuration at import time
+    os.environ.setdefault("MQTT_PORT", str(args.port))
+    os.environ["MONGODB_DATABASE"] = args.database
+    os.environ["ANOMALY_CHECKPOINT_INTERVAL"] = "0"
+    sys.path.insert(0, os.path.abspath(args.writer_dir))
+    from writer_service import MQTTWriterService
+    from anomaly_detector import StreamingAnomalyDetector
+
+    if args.quiet:
+        logging.getLogger("writer_service").setLevel(logging.WARNING)
+
+    service = MQTTWriterService()
+    if not service.connect_mongodb():
+        raise SystemExit("Cannot replay into the writer without MongoDB")
+    # Start from empty state instead of the last checkpoint so every replay
+    # flags the same readings; the state is not checkpointed afterwards
+    service.detector = StreamingAnomalyDetector()
+    if not args.keep:
+        # Emptied rather than dropped so the writer's indexes stay in place
+        # and every run inserts into the same starting state
+        for collection in (service.sensor_collection, service.status_collection):
+            removed = collection.delete_many({}).deleted_count
+            logger.info(f"Emptied {args.database}.{collection.name} ({removed} documents)")
+
+    def deliver(topic, payload):
+        service.on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+
+    def close():
+        service.mongo_client.close()
+
+    return deliver, close
+
+def replay(args):
+    """Replay a recording, keeping the original spacing divided by --speed"""
+    speed = None if args.speed == "max" else float(args.speed.rstrip("x"))
+    deliver, close = writer_sink(args) if args.direct else broker_sink(args)
+
+    count = 0
+    first_ts = None
+    start = time.perf_counter()
+    try:
+        for timestamp, topic, payload in TrafficReader(args.file).messages():
+            if first_ts is None:
+                first_ts = timestamp
+            if speed:
+                delay = (timestamp - first_ts) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            deliver(topic, payload)
+            count += 1
+            if args.limit and count >= args.limit:
+                break
+    finally:
+        close()
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Replayed {count} messages in {elapsed:.2f}s ({rate:.1f} msg/s, speed {args.speed})")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Record and replay MQTT traffic")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record live traffic")
+    record_parser.add_argument("file")
+    record_parser.add_argument("--duration", type=int, default=0, help="seconds, 0 = until Ctrl+C")
+
+    replay_parser = subparsers.add_parser("replay", help="replay a recording")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("--speed", default="1", help="1x, Nx (times faster) or max")
+    replay_parser.add_argument("--direct", action="store_true",
+                               help="call MQTTWriterService.on_message instead of publishing")
+    replay_parser.add_argument("--writer-dir", default=WRITER_DIR)
+    replay_parser.add_argument("--database", default="hydroponics_replay",
+                               help="MongoDB database for --direct replays")
+    replay_parser.add_argument("--keep", action="store_true",
+                               help="keep the replay database's readings instead of emptying it first")
+    replay_parser.add_argument("--qos", type=int, default=0)
+    replay_parser.add_argument("--limit", type=int, default=0, help="stop after N messages")
+    replay_parser.add_argument("--quiet", action="store_true", help="silence per-message writer logs")
+
+    for sub in (record_parser, replay_parser):
+        sub.add_argument("--broker", default=os.getenv('MQTT_BROKER', 'localhost'))
+        sub.add_argument("--port", type=int, default=int(os.getenv('MQTT_PORT', 1883)))
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        replay(args)
+
+if __name__ == "__main__":
+    main()
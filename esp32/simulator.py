@@ -12,6 +12,44 @@ NODE_ID = os.getenv('NODE_ID', 'node_001')
 MQTT_BROKER = os.getenv('MQTT_BROKER', 'localhost')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
 
+# Reporting: "raw" publishes every reading, "exception" only when a sensor
+# moves beyond its deadband (or MAX_SILENCE expires), "summary" publishes
+# min/max/mean over SUMMARY_WINDOW. Defaults are chosen to send fewer
+# messages than raw (144/day): over 24 h of the stable profile, exception
+# sends ~41 and summary 23
+REPORT_MODE = os.getenv('REPORT_MODE', 'raw')
+SENSOR_INTERVAL = int(os.getenv('SENSOR_INTERVAL', 600))  # raw mode, seconds
+SAMPLE_INTERVAL = int(os.getenv('SAMPLE_INTERVAL', 30))  # exception/summary modes, seconds
+MAX_SILENCE = int(os.getenv('MAX_SILENCE', 3600))
+SUMMARY_WINDOW = int(os.getenv('SUMMARY_WINDOW', 3600))
+# About 3x the stable profile's steady-state spread, so noise alone rarely
+# triggers a report
+DEADBANDS = {
+    "temperature": float(os.getenv('DEADBAND_TEMPERATURE', 1.0)),
+    "humidity": float(os.getenv('DEADBAND_HUMIDITY', 5.0)),
+    "ph": float(os.getenv('DEADBAND_PH', 0.2)),
+    "gas": float(os.getenv('DEADBAND_GAS', 100))
+}
+# Same limits as the reader's alerts; crossing one is always reported
+ALERT_THRESHOLDS = {
+    "temperature": {"min": 15, "max": 30},
+    "humidity": {"min": 30, "max": 90},
+    "ph": {"min": 5.0, "max": 8.0},
+    "gas": {"min": 200, "max": 1000}
+}
+
+# "random": independent readings, "stable": slow drift around a setpoint.
+# Independent readings jump past any deadband on almost every sample, so
+# exception/summary modes default to the stable profile
+SENSOR_PROFILE = os.getenv('SENSOR_PROFILE', 'random' if REPORT_MODE == 'raw' else 'stable')
+# Setpoint, noise per sample and range for the stable profile
+STABLE_PROFILE = {
+    "temperature": {"setpoint": 22.0, "noise": 0.1, "min": 19.0, "max": 27.0, "digits": 2},
+    "humidity": {"setpoint": 60.0, "noise": 0.5, "min": 45.0, "max": 80.0, "digits": 2},
+    "ph": {"setpoint": 6.5, "noise": 0.02, "min": 5.5, "max": 7.5, "digits": 2},
+    "gas": {"setpoint": 400.0, "noise": 10.0, "min": 300.0, "max": 600.0, "digits": 0}
+}
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,9 +62,21 @@ class ESP32Simulator:
         self.mqtt_client = None
         self.connected = False
         self.irrigation_active = False
+        # Last status sent per command_id, to answer retried commands
+        self.handled_commands = {}
+        # Stable profile state
+        self.current_values = {sensor: p["setpoint"] for sensor, p in STABLE_PROFILE.items()}
+        # Report-by-exception state
+        self.last_reported = None
+        self.last_report_time = 0
+        # Summary window state
+        self.window = None
         
     def generate_sensor_data(self):
         """Generate random sensor data simulating real sensors"""
+        if SENSOR_PROFILE == "stable":
+            return self.generate_stable_data()
+        
         # Add some realistic variations
         base_temp = 22.0 + random.uniform(-3, 5)
         base_humidity = 60.0 + random.uniform(-15, 20)
@@ -46,6 +96,83 @@ class ESP32Simulator:
             "irrigation_active": self.irrigation_active
         }
     
+    def generate_stable_data(self):
+        """Mean-reverting random walk, like a well controlled hydroponic setup"""
+        sensors = {}
+        for sensor, profile in STABLE_PROFILE.items():
+            value = self.current_values[sensor]
+            value += 0.05 * (profile["setpoint"] - value) + random.gauss(0, profile["noise"])
+            value = min(max(value, profile["min"]), profile["max"])
+            self.current_values[sensor] = value
+            sensors[sensor] = round(value, profile["digits"])
+        
+        return {
+            "node_id": NODE_ID,
+            "timestamp": time.time(),
+            "sensors": sensors,
+            "status": "active",
+            "irrigation_active": self.irrigation_active
+        }
+    
+    def exception_reason(self, sensors, now):
+        """Why a sample must be reported in exception mode, or None"""
+        if self.last_reported is None or now - self.last_report_time >= MAX_SILENCE:
+            return "max_silence"
+        
+        for sensor, value in sensors.items():
+            last = self.last_reported.get(sensor)
+            if last is None:
+                return "deadband"
+            limits = ALERT_THRESHOLDS.get(sensor)
+            if limits:
+                in_range = limits["min"] <= value <= limits["max"]
+                was_in_range = limits["min"] <= last <= limits["max"]
+                if in_range != was_in_range:
+                    return "threshold"
+            if abs(value - last) > DEADBANDS.get(sensor, 0):
+                return "deadband"
+        return None
+    
+    def add_to_window(self, sensors, now):
+        """Fold a sample into the current summary window"""
+        if self.window is None:
+            self.window = {"start": now, "samples": 0, "stats": {}}
+        self.window["samples"] += 1
+        for sensor, value in sensors.items():
+            stats = self.window["stats"].setdefault(sensor, {"min": value, "max": value, "sum": 0.0})
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+            stats["sum"] += value
+    
+    def build_summary(self, now):
+        """Close the current window into a summary message"""
+        samples = self.window["samples"]
+        summary = {
+            sensor: {
+                "min": stats["min"],
+                "max": stats["max"],
+                "mean": round(stats["sum"] / samples, 3)
+            }
+            for sensor, stats in self.window["stats"].items()
+        }
+        message = {
+            "node_id": NODE_ID,
+            "timestamp": now,
+            "type": "summary",
+            "window": {
+                "start": self.window["start"],
+                "end": now,
+                "samples": samples
+            },
+            # Means under "sensors" so consumers of raw readings keep working
+            "sensors": {sensor: stats["mean"] for sensor, stats in summary.items()},
+            "summary": summary,
+            "status": "active",
+            "irrigation_active": self.irrigation_active
+        }
+        self.window = None
+        return message
+    
     def on_connect(self, client, userdata, flags, rc):
         """Callback for MQTT connection"""
         if rc == 0:
@@ -86,26 +213,33 @@ class ESP32Simulator:
         try:
             action = command.get("action")
             duration = command.get("duration", 5)
+            command_id = command.get("command_id")
+            
+            # A retried command we already executed: repeat the last status only
+            if command_id and command_id in self.handled_commands:
+                logger.info(f"Duplicate command {command_id}, resending status")
+                self.send_status_update(self.handled_commands[command_id], duration, command_id)
+                return
             
             if action == "activate":
                 logger.info(f"Activating irrigation for {duration} seconds")
                 self.irrigation_active = True
-                self.send_status_update("irrigation_started", duration)
+                self.send_status_update("irrigation_started", duration, command_id)
                 
                 # Simulate irrigation duration
                 time.sleep(duration)
                 self.irrigation_active = False
-                self.send_status_update("irrigation_completed", duration)
+                self.send_status_update("irrigation_completed", duration, command_id)
                 
             elif action == "deactivate":
                 logger.info("Deactivating irrigation")
                 self.irrigation_active = False
-                self.send_status_update("irrigation_stopped")
+                self.send_status_update("irrigation_stopped", command_id=command_id)
                 
         except Exception as e:
             logger.error(f"Error handling irrigation command: {e}")
     
-    def send_status_update(self, action, duration=None):
+    def send_status_update(self, action, duration=None, command_id=None):
         """Send status update to MQTT broker"""
         try:
             status_msg = {
@@ -118,6 +252,13 @@ class ESP32Simulator:
             if duration:
                 status_msg["duration"] = duration
             
+            # Echo the command ID so the command service can correlate the ack
+            if command_id:
+                status_msg["command_id"] = command_id
+                self.handled_commands[command_id] = action
+                if len(self.handled_commands) > 100:
+                    self.handled_commands.pop(next(iter(self.handled_commands)))
+            
             topic = f"status/{NODE_ID}"
             message = json.dumps(status_msg)
             
@@ -127,10 +268,11 @@ class ESP32Simulator:
         except Exception as e:
             logger.error(f"Error sending status update: {e}")
     
-    def publish_sensor_data(self):
+    def publish_sensor_data(self, sensor_data=None):
         """Publish sensor data to MQTT broker"""
         try:
-            sensor_data = self.generate_sensor_data()
+            if sensor_data is None:
+                sensor_data = self.generate_sensor_data()
             topic = f"sensor/data/{NODE_ID}"
             message = json.dumps(sensor_data)
             
@@ -140,6 +282,25 @@ class ESP32Simulator:
         except Exception as e:
             logger.error(f"Error publishing sensor data: {e}")
     
+    def sample_and_report(self, now):
+        """Take one sample and publish it, or not, according to REPORT_MODE"""
+        sensor_data = self.generate_sensor_data()
+        sensors = sensor_data["sensors"]
+        
+        if REPORT_MODE == "exception":
+            reason = self.exception_reason(sensors, now)
+            if reason:
+                sensor_data["type"] = "exception"
+                sensor_data["reason"] = reason
+                self.publish_sensor_data(sensor_data)
+                self.last_reported = dict(sensors)
+                self.last_report_time = now
+        
+        elif REPORT_MODE == "summary":
+            self.add_to_window(sensors, now)
+            if now - self.window["start"] >= SUMMARY_WINDOW:
+                self.publish_sensor_data(self.build_summary(now))
+    
     def connect_mqtt(self):
         """Connect to MQTT broker"""
         try:
@@ -175,16 +336,22 @@ class ESP32Simulator:
         
         # Main loop
         last_sensor_publish = 0
-        sensor_interval = 600  #seconds
+        last_sample = 0
+        logger.info(f"Report mode: {REPORT_MODE}")
         
         try:
             while True:
                 current_time = time.time()
                 
-                # Publish sensor data every 30 seconds
-                if current_time - last_sensor_publish >= sensor_interval:
-                    self.publish_sensor_data()
-                    last_sensor_publish = current_time
+                if REPORT_MODE == "raw":
+                    # Publish sensor data every SENSOR_INTERVAL seconds
+                    if current_time - last_sensor_publish >= SENSOR_INTERVAL:
+                        self.publish_sensor_data()
+                        last_sensor_publish = current_time
+                
+                elif current_time - last_sample >= SAMPLE_INTERVAL:
+                    last_sample = current_time
+                    self.sample_and_report(current_time)
                 
                 time.sleep(1)
                 
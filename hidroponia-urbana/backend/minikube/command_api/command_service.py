@@ -0,0 +1,380 @@
+# Command Service - dispatches irrigation commands to node groups over MQTT
+# and tracks the acknowledgements sent back on status/#
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import Flask, jsonify, request
+from flask_cors import CORS
+import paho.mqtt.client as mqtt
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# Configuration
+MQTT_BROKER = os.getenv('MQTT_BROKER')
+MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+STATUS_TOPIC = "status/#"
+
+MONGODB_URI = os.getenv('MONGODB_HEADLESS_SERVICE')
+DATABASE_NAME = "hydroponics"
+SENSOR_COLLECTION = "sensor_readings"
+COMMAND_COLLECTION = "irrigation_commands"
+
+# Messages published before waiting for the broker to confirm them
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', 500))
+# Seconds without an ack before a command is re-sent to a node
+ACK_TIMEOUT = int(os.getenv('ACK_TIMEOUT', 15))
+MAX_ATTEMPTS = int(os.getenv('MAX_ATTEMPTS', 3))
+# Seconds between retry checks and MongoDB flushes
+MONITOR_INTERVAL = float(os.getenv('MONITOR_INTERVAL', 1))
+MAX_DISPATCH_NODES = int(os.getenv('MAX_DISPATCH_NODES', 10000))
+# Longest irrigation a single command may request, in seconds
+MAX_DURATION = int(os.getenv('MAX_DURATION', 3600))
+
+VALID_ACTIONS = ("activate", "deactivate")
+# Status actions reported by the nodes and the state they move a node to
+ACK_STATES = {
+    "irrigation_started": "acked",
+    "irrigation_completed": "completed",
+    "irrigation_stopped": "completed"
+}
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return round(values[k], 3)
+
+class CommandTracker:
+    """In-memory state of one command across all its target nodes"""
+
+    def __init__(self, action, duration, node_ids):
+        self.command_id = uuid.uuid4().hex
+        self.action = action
+        self.duration = duration
+        self.created_at = datetime.utcnow()
+        self.nodes = {
+            node_id: {"state": "pending", "attempts": 0, "dispatched_at": None,
+                      "sent_at": None, "acked_at": None, "completed_at": None}
+            for node_id in node_ids
+        }
+        self.dirty = set()
+
+    def payload(self):
+        return json.dumps({
+            "action": self.action,
+            "duration": self.duration,
+            "command_id": self.command_id
+        })
+
+    def mark_sent(self, node_id, now):
+        node = self.nodes[node_id]
+        node["attempts"] += 1
+        node["sent_at"] = now
+        if node["dispatched_at"] is None:
+            node["dispatched_at"] = now
+        if node["state"] == "pending":
+            node["state"] = "sent"
+        self.dirty.add(node_id)
+
+    def record_ack(self, node_id, status_action, now):
+        """Apply a status message from a node; False if it is not ours"""
+        node = self.nodes.get(node_id)
+        new_state = ACK_STATES.get(status_action)
+        if node is None or new_state is None or node["state"] in ("completed", "failed"):
+            return False
+        if node["acked_at"] is None:
+            node["acked_at"] = now
+        if new_state == "completed":
+            node["completed_at"] = now
+        node["state"] = new_state
+        self.dirty.add(node_id)
+        return True
+
+    def expire(self, now):
+        """Return nodes to re-send to, failing the ones out of attempts"""
+        retries = []
+        for node_id, node in self.nodes.items():
+            if node["state"] == "sent" and now - node["sent_at"] >= ACK_TIMEOUT:
+                if node["attempts"] < MAX_ATTEMPTS:
+                    retries.append(node_id)
+                else:
+                    node["state"] = "failed"
+                    self.dirty.add(node_id)
+            elif node["state"] == "acked" and now - node["acked_at"] >= (self.duration or 0) + ACK_TIMEOUT:
+                # Irrigation started but never reported completion
+                node["state"] = "failed"
+                self.dirty.add(node_id)
+        return retries
+
+    def finished(self):
+        return all(node["state"] in ("completed", "failed") for node in self.nodes.values())
+
+    def summary(self):
+        """Counts per state and ack/completion latency percentiles (seconds)"""
+        counts = {}
+        ack_latencies = []
+        completion_latencies = []
+        for node in self.nodes.values():
+            counts[node["state"]] = counts.get(node["state"], 0) + 1
+            if node["acked_at"] is not None:
+                ack_latencies.append(node["acked_at"] - node["dispatched_at"])
+            if node["completed_at"] is not None:
+                completion_latencies.append(node["completed_at"] - node["dispatched_at"])
+        ack_latencies.sort()
+        completion_latencies.sort()
+
+        if not self.finished():
+            status = "in_progress"
+        elif counts.get("failed"):
+            status = "partial" if counts.get("completed") else "failed"
+        else:
+            status = "completed"
+
+        return {
+            "status": status,
+            "counts": counts,
+            "latency": {
+                "ack_p50": percentile(ack_latencies, 50),
+                "ack_p90": percentile(ack_latencies, 90),
+                "ack_p99": percentile(ack_latencies, 99),
+                "completion_p50": percentile(completion_latencies, 50),
+                "completion_p90": percentile(completion_latencies, 90),
+                "completion_p99": percentile(completion_latencies, 99)
+            }
+        }
+
+    def to_document(self):
+        return {
+            "_id": self.command_id,
+            "action": self.action,
+            "duration": self.duration,
+            "created_at": self.created_at,
+            "updated_at": datetime.utcnow(),
+            "target_count": len(self.nodes),
+            "nodes": self.nodes,
+            **self.summary()
+        }
+
+class CommandService:
+    def __init__(self):
+        self.mqtt_client = None
+        self.mongo_client = None
+        self.sensor_collection = None
+        self.command_collection = None
+        # command_id -> CommandTracker, only for commands still in progress
+        self.trackers = {}
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+
+    def start(self):
+        """Connect to MongoDB and MQTT and start the retry/flush monitor"""
+        self.mongo_client = MongoClient(MONGODB_URI)
+        db = self.mongo_client[DATABASE_NAME]
+        self.sensor_collection = db[SENSOR_COLLECTION]
+        self.command_collection = db[COMMAND_COLLECTION]
+        self.command_collection.create_index([("created_at", -1)])
+
+        self.mqtt_client = mqtt.Client()
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+        self.mqtt_client.max_inflight_messages_set(min(DISPATCH_BATCH_SIZE, 100))
+        self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        self.mqtt_client.loop_start()
+
+        threading.Thread(target=self.monitor, daemon=True).start()
+        logger.info("Command service started")
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback for MQTT connection"""
+        if rc == 0:
+            client.subscribe(STATUS_TOPIC)
+            self.connected.set()
+            logger.info(f"Connected to MQTT broker, subscribed to {STATUS_TOPIC}")
+        else:
+            self.connected.clear()
+            logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
+
+    def on_message(self, client, userdata, msg):
+        """Correlate node status messages with in-flight commands"""
+        try:
+            status = json.loads(msg.payload.decode('utf-8'))
+            command_id = status.get("command_id")
+            if not command_id:
+                return
+            with self.lock:
+                tracker = self.trackers.get(command_id)
+                if tracker is not None:
+                    tracker.record_ack(status.get("node_id"), status.get("action"), time.time())
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to decode status payload: {e}")
+        except Exception as e:
+            logger.error(f"Error processing status message: {e}")
+
+    def active_nodes(self):
+        """Nodes that reported sensor data in the last 24 hours"""
+        since = datetime.utcnow() - timedelta(hours=24)
+        return self.sensor_collection.distinct("node_id", {"server_timestamp": {"$gte": since}})
+
+    def publish(self, tracker, node_ids):
+        """Publish a command to the given nodes in batches of DISPATCH_BATCH_SIZE.
+        Returns how many nodes were in batches that could not be published;
+        they stay "sent", so the monitor re-sends them after ACK_TIMEOUT"""
+        payload = tracker.payload()
+        unpublished = 0
+        for i in range(0, len(node_ids), DISPATCH_BATCH_SIZE):
+            batch = node_ids[i:i + DISPATCH_BATCH_SIZE]
+            # Mark before publishing so a fast ack always finds the node as sent
+            now = time.time()
+            with self.lock:
+                for node_id in batch:
+                    tracker.mark_sent(node_id, now)
+            try:
+                infos = [self.mqtt_client.publish(f"control/riego/{node_id}", payload, qos=1)
+                         for node_id in batch]
+                # Wait for the broker before queueing the next batch
+                for info in infos:
+                    info.wait_for_publish(timeout=10)
+            except (ValueError, RuntimeError) as e:
+                # Not connected (RuntimeError) or client queue full (ValueError)
+                unpublished += len(batch)
+                logger.error(f"Failed to publish command {tracker.command_id} to {len(batch)} nodes: {e}")
+        return unpublished
+
+    def dispatch(self, action, duration, node_ids):
+        """Create and publish a command, returning its tracker and the
+        number of nodes it could not be published to"""
+        tracker = CommandTracker(action, duration, node_ids)
+        self.command_collection.insert_one(tracker.to_document())
+        with self.lock:
+            self.trackers[tracker.command_id] = tracker
+        unpublished = self.publish(tracker, node_ids)
+        return tracker, unpublished
+
+    def monitor(self):
+        """Re-send unacknowledged commands and flush state to MongoDB"""
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            try:
+                self.check_trackers()
+            except Exception as e:
+                logger.error(f"Error in command monitor: {e}")
+
+    def check_trackers(self):
+        now = time.time()
+        retries = []
+        updates = []
+        with self.lock:
+            for command_id, tracker in list(self.trackers.items()):
+                nodes = tracker.expire(now)
+                if nodes:
+                    retries.append((tracker, nodes))
+                if tracker.dirty:
+                    dirty = set(tracker.dirty)
+                    fields = {f"nodes.{node_id}": dict(tracker.nodes[node_id]) for node_id in dirty}
+                    fields.update(tracker.summary(), updated_at=datetime.utcnow())
+                    updates.append((tracker, dirty, fields))
+                    tracker.dirty.clear()
+                if tracker.finished() and not nodes:
+                    del self.trackers[command_id]
+
+        # Store state before retrying, so a broker outage can't lose transitions
+        for tracker, dirty, fields in updates:
+            try:
+                self.command_collection.update_one({"_id": tracker.command_id}, {"$set": fields})
+            except PyMongoError as e:
+                logger.error(f"Failed to store state of command {tracker.command_id}: {e}")
+                # Keep the tracker and its changes for the next flush
+                with self.lock:
+                    tracker.dirty.update(dirty)
+                    self.trackers.setdefault(tracker.command_id, tracker)
+
+        for tracker, nodes in retries:
+            logger.info(f"Retrying command {tracker.command_id} on {len(nodes)} nodes")
+            try:
+                self.publish(tracker, nodes)
+            except Exception as e:
+                logger.error(f"Error retrying command {tracker.command_id}: {e}")
+
+
+app = Flask(__name__)
+CORS(app)  # Enable CORS for frontend access
+
+service = CommandService()
+service.start()
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        "status": "healthy" if service.connected.is_set() else "unhealthy",
+        "service": "command_service",
+        "in_progress": len(service.trackers),
+        "timestamp": datetime.utcnow().isoformat()
+    }), 200 if service.connected.is_set() else 500
+
+@app.route('/api/commands', methods=['POST'])
+def create_command():
+    """Dispatch an irrigation command to a list of nodes or to all active nodes"""
+    try:
+        body = request.get_json(force=True)
+        action = body.get("action", "activate")
+        duration = int(body.get("duration", 5))
+        if action not in VALID_ACTIONS:
+            return jsonify({"error": f"action must be one of {', '.join(VALID_ACTIONS)}"}), 400
+        if not 0 <= duration <= MAX_DURATION:
+            return jsonify({"error": f"duration must be between 0 and {MAX_DURATION} seconds"}), 400
+
+        if body.get("all_active"):
+            node_ids = service.active_nodes()
+        else:
+            node_ids = body.get("node_ids") or []
+            # Node IDs become the last level of control/riego/<node_id>
+            if not isinstance(node_ids, list) or not all(
+                    isinstance(n, str) and n and not set(n) & set("+#/") for n in node_ids):
+                return jsonify({"error": "node_ids must be a list of non-empty strings without '+', '#' or '/'"}), 400
+            node_ids = list(dict.fromkeys(node_ids))
+        if not node_ids:
+            return jsonify({"error": "No target nodes"}), 400
+        if len(node_ids) > MAX_DISPATCH_NODES:
+            return jsonify({"error": f"At most {MAX_DISPATCH_NODES} nodes per command"}), 400
+
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except Exception as e:
+        logger.error(f"Error resolving command targets: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    try:
+        start = time.time()
+        tracker, unpublished = service.dispatch(action, duration, node_ids)
+    except Exception as e:
+        logger.error(f"Error dispatching command: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    result = {
+        "command_id": tracker.command_id,
+        "action": action,
+        "target_count": len(node_ids),
+        "unpublished_count": unpublished,
+        "dispatch_seconds": round(time.time() - start, 3)
+    }
+    if unpublished == len(node_ids):
+        # Stored and tracked: the monitor keeps re-sending until MAX_ATTEMPTS
+        result["error"] = "Command could not be published to MQTT, it will be retried"
+        return jsonify(result), 503
+    return jsonify(result), 202
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5002)
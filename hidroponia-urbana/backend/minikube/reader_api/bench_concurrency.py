@@ -0,0 +1,86 @@
+# Concurrency benchmark for the reader API - simulates many dashboard clients
+# Usage: python bench_concurrency.py --url http://localhost:5001 --clients 200 --duration 60
+# bench_reader.sh runs it against both READER_MODEs inside the pod limits
+# (bench_local.sh does the same without Docker, against bench_mock_mongo.py)
+import time
+import json
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Requests issued by one dashboard refresh
+DASHBOARD_ENDPOINTS = [
+    "/api/last-values",
+    "/api/history?hours=24&limit=100",
+    "/api/statistics?hours=24",
+    "/api/alerts?hours=24"
+]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return values[k]
+
+def dashboard_client(base_url, deadline, latencies, errors, lock):
+    """Refresh the dashboard in a loop until the deadline"""
+    while time.time() < deadline:
+        for endpoint in DASHBOARD_ENDPOINTS:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + endpoint, timeout=30) as response:
+                    response.read()
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.setdefault(endpoint, []).append(elapsed)
+            except Exception:
+                with lock:
+                    errors[endpoint] = errors.get(endpoint, 0) + 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Reader API concurrency benchmark")
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=int, default=60, help="seconds")
+    parser.add_argument("--label", help="recorded with the report, e.g. the READER_MODE")
+    parser.add_argument("--output", help="append the report as one JSON line to this file")
+    args = parser.parse_args()
+
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        for _ in range(args.clients):
+            executor.submit(dashboard_client, args.url, deadline, latencies, errors, lock)
+
+    report = {"label": args.label, "clients": args.clients, "duration_s": args.duration,
+              "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "endpoints": {}}
+    all_latencies = []
+    for endpoint in DASHBOARD_ENDPOINTS:
+        values = sorted(latencies.get(endpoint, []))
+        all_latencies.extend(values)
+        report["endpoints"][endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "p99_ms": round(percentile(values, 99), 1)
+        }
+    all_latencies.sort()
+    report["overall"] = {
+        "requests": len(all_latencies),
+        "rps": round(len(all_latencies) / args.duration, 1),
+        "p50_ms": round(percentile(all_latencies, 50), 1),
+        "p99_ms": round(percentile(all_latencies, 99), 1)
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+if __name__ == "__main__":
+    main()
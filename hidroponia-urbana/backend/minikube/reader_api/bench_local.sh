@@ -0,0 +1,102 @@
+#!/bin/bash
+
+# bench_local.sh - Corre bench_concurrency.py contra los dos READER_MODE sin
+# Docker: cada reader corre en un cgroup con los limites del pod (250m CPU /
+# 128Mi) y consulta a bench_mock_mongo.py, que responde con resultados fijos.
+#
+# Mide el costo propio del reader (serializacion, pool, modelo de workers);
+# el tiempo de consulta en MongoDB es cero, asi que el p99 es una cota
+# inferior. Para la medicion completa usar bench_reader.sh.
+#
+# Uso (root, cgroup v1 o v2):
+#   ./bench_local.sh
+#   CLIENTS=200 DURATION=60 ./bench_local.sh
+
+CLIENTS="${CLIENTS:-200}"
+DURATION="${DURATION:-60}"
+SEED_NODES="${SEED_NODES:-200}"
+RESULTS="${RESULTS:-bench_results.jsonl}"
+MOCK_PORT=27999
+API_PORT=5101
+GROUP=reader-bench
+
+cd "$(dirname "$0")"
+
+if [ -f /sys/fs/cgroup/cgroup.controllers ]; then
+    CPU_DIR=/sys/fs/cgroup/$GROUP
+    MEM_DIR=$CPU_DIR
+    mkdir -p "$CPU_DIR" || exit 1
+    echo "25000 100000" > "$CPU_DIR/cpu.max"
+    echo $((128 * 1024 * 1024)) > "$MEM_DIR/memory.max"
+else
+    CPU_DIR=/sys/fs/cgroup/cpu/$GROUP
+    MEM_DIR=/sys/fs/cgroup/memory/$GROUP
+    mkdir -p "$CPU_DIR" "$MEM_DIR" || exit 1
+    echo 100000 > "$CPU_DIR/cpu.cfs_period_us"
+    echo 25000 > "$CPU_DIR/cpu.cfs_quota_us"
+    echo $((128 * 1024 * 1024)) > "$MEM_DIR/memory.limit_in_bytes"
+fi
+
+peak_memory_mib() {
+    if [ -f "$MEM_DIR/memory.peak" ]; then
+        echo $(( $(cat "$MEM_DIR/memory.peak") / 1024 / 1024 ))
+    else
+        echo $(( $(cat "$MEM_DIR/memory.max_usage_in_bytes") / 1024 / 1024 ))
+    fi
+}
+
+oom_kills() {
+    grep -h "^oom_kill " "$MEM_DIR/memory.events" "$MEM_DIR/memory.oom_control" 2>/dev/null | awk '{print $2; exit}'
+}
+
+cleanup() {
+    [ -n "$API_PID" ] && kill "$API_PID" 2>/dev/null
+    [ -n "$MOCK_PID" ] && kill "$MOCK_PID" 2>/dev/null
+    wait 2>/dev/null
+}
+trap cleanup EXIT
+
+echo "🚀 Iniciando MongoDB simulado ($SEED_NODES nodos)..."
+python bench_mock_mongo.py --port "$MOCK_PORT" --nodes "$SEED_NODES" &
+MOCK_PID=$!
+sleep 2
+
+for mode in sync async; do
+    echo "📊 Benchmark READER_MODE=$mode ($CLIENTS clientes, $DURATION s)..."
+    # Mismo comando que Dockerfile.reader, dentro del cgroup
+    if [ "$mode" = "async" ]; then
+        APP_CMD="gunicorn -k uvicorn.workers.UvicornWorker --bind 127.0.0.1:$API_PORT reader_api_async:app"
+    else
+        APP_CMD="gunicorn -k gthread --bind 127.0.0.1:$API_PORT reader_api:app"
+    fi
+    [ -f "$MEM_DIR/memory.max_usage_in_bytes" ] && echo 0 > "$MEM_DIR/memory.max_usage_in_bytes"
+    # El contador de oom_kill del cgroup no se reinicia: se reporta la diferencia
+    OOM_BEFORE=$(oom_kills)
+    GUNICORN_CMD_ARGS="--timeout 300 --threads 8" \
+    MONGODB_HEADLESS_SERVICE="mongodb://127.0.0.1:$MOCK_PORT/" \
+        sh -c "echo \$\$ > $CPU_DIR/cgroup.procs; echo \$\$ > $MEM_DIR/cgroup.procs; exec $APP_CMD" \
+        > "/tmp/reader-bench-$mode.log" 2>&1 &
+    API_PID=$!
+    until curl -sf "http://127.0.0.1:$API_PORT/api/health" >/dev/null; do
+        if ! kill -0 "$API_PID" 2>/dev/null; then
+            echo "❌ El reader no arranco en modo $mode:"
+            cat "/tmp/reader-bench-$mode.log"
+            exit 1
+        fi
+        sleep 1
+    done
+
+    python bench_concurrency.py --url "http://127.0.0.1:$API_PORT" --clients "$CLIENTS" \
+        --duration "$DURATION" --label "$mode (mock MongoDB, cgroup 250m/128Mi)" --output "$RESULTS"
+
+    PEAK=$(peak_memory_mib)
+    OOM=$(( $(oom_kills) - ${OOM_BEFORE:-0} ))
+    echo "{\"label\": \"$mode (mock MongoDB, cgroup 250m/128Mi)\", \"peak_memory_mib\": $PEAK, \"oom_kills\": $OOM}" >> "$RESULTS"
+    echo "✅ $mode: memoria maxima ${PEAK} MiB, oom_kill=$OOM"
+
+    kill "$API_PID"
+    wait "$API_PID" 2>/dev/null
+    API_PID=
+done
+
+echo "📄 Resultados en $RESULTS"
@@ -0,0 +1,141 @@
+# Minimal MongoDB wire-protocol responder for bench_local.sh
+#
+# Answers the driver handshake and returns canned, realistically sized
+# results for the dashboard queries (200 nodes), so the reader's own serving
+# overhead can be measured where no mongod is available. Query time on the
+# database side is zero: p99 figures from this backend are a lower bound.
+#
+# Usage: python bench_mock_mongo.py --port 27999 --nodes 200
+import time
+import random
+import struct
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+import bson
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+HEADER = struct.Struct("<iiii")
+
+def _reading(node, ts):
+    return {
+        "_id": bson.ObjectId(),
+        "node_id": f"ESP32_{node:04d}",
+        "timestamp": ts,
+        "server_timestamp": datetime.utcfromtimestamp(ts),
+        "processed_at": ts,
+        "sensors": {
+            "temperature": round(random.gauss(22, 3), 2),
+            "humidity": round(random.gauss(60, 10), 2),
+            "ph": round(random.gauss(6.5, 0.5), 2),
+            "gas": round(random.gauss(500, 150), 1)
+        },
+        "irrigation_active": False
+    }
+
+def canned_results(nodes):
+    """Result documents per dashboard query, sized like a 24 h dataset"""
+    now = time.time()
+    since = datetime.utcnow() - timedelta(hours=24)
+    statistics = []
+    for node in range(nodes):
+        doc = {"_id": f"ESP32_{node:04d}", "count": 288, "first_reading": since,
+               "last_reading": datetime.utcnow()}
+        for sensor in ("temperature", "humidity", "ph", "gas"):
+            doc.update({f"min_{sensor}": 1.0, f"max_{sensor}": 2.0, f"avg_{sensor}": 1.5})
+        statistics.append(doc)
+    return {
+        "last_values": [_reading(node, now) for node in range(nodes)],
+        "nodes": [{"_id": f"ESP32_{node:04d}", "last_seen": datetime.utcnow()} for node in range(nodes)],
+        "statistics": statistics,
+        "history": [_reading(random.randrange(nodes), now - i * 60) for i in range(100)],
+        "alerts": [_reading(random.randrange(nodes), now - i * 300) for i in range(50)]
+    }
+
+def classify(command):
+    """Map a reader command to one of the canned result sets"""
+    if "aggregate" in command:
+        stages = {key for stage in command.get("pipeline", []) for key in stage}
+        if "$replaceRoot" in stages:
+            return "last_values"
+        if "$addFields" in stages:
+            return "statistics"
+        return "nodes"
+    if "find" in command:
+        return "alerts" if "$or" in command.get("filter", {}) else "history"
+    return None
+
+class MockServer:
+    def __init__(self, nodes):
+        self.connections = 0
+        self.replies = {}
+        for name, docs in canned_results(nodes).items():
+            # Encoded once; every reply only differs in its header
+            self.replies[name] = bson.encode({
+                "cursor": {"id": bson.Int64(0), "ns": "hydroponics.sensor_readings", "firstBatch": docs},
+                "ok": 1.0
+            })
+        self.ok = bson.encode({"ok": 1.0})
+
+    def hello(self):
+        return bson.encode({
+            "ismaster": True, "isWritablePrimary": True, "helloOk": True,
+            "maxBsonObjectSize": 16 * 1024 * 1024, "maxMessageSizeBytes": 48000000,
+            "maxWriteBatchSize": 100000, "localTime": datetime.utcnow(),
+            "logicalSessionTimeoutMinutes": 30, "connectionId": self.connections,
+            "minWireVersion": 0, "maxWireVersion": 17, "ok": 1.0
+        })
+
+    def reply_for(self, command):
+        name = next(iter(command))
+        if name.lower() in ("hello", "ismaster"):
+            return self.hello()
+        result = classify(command)
+        return self.replies[result] if result else self.ok
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                length, request_id, _, op_code = HEADER.unpack(header)
+                body = await reader.readexactly(length - HEADER.size)
+
+                if op_code == OP_QUERY:
+                    # Legacy handshake: flags, collection name, skip, limit, query
+                    name_end = body.index(b"\x00", 4)
+                    command = bson.decode(body[name_end + 9:])
+                    doc = self.reply_for(command)
+                    payload = struct.pack("<iqii", 0, 0, 0, 1) + doc
+                    reply_op = OP_REPLY
+                elif op_code == OP_MSG:
+                    # flagBits, then a kind 0 section with the command document
+                    size = struct.unpack_from("<i", body, 5)[0]
+                    command = bson.decode(body[5:5 + size])
+                    payload = struct.pack("<I", 0) + b"\x00" + self.reply_for(command)
+                    reply_op = OP_MSG
+                else:
+                    return
+                writer.write(HEADER.pack(HEADER.size + len(payload), 0, request_id, reply_op) + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description="MongoDB wire-protocol responder for benchmarks")
+    parser.add_argument("--port", type=int, default=27999)
+    parser.add_argument("--nodes", type=int, default=200)
+    args = parser.parse_args()
+
+    server = MockServer(args.nodes)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", args.port)
+    print(f"Mock MongoDB listening on 127.0.0.1:{args.port} ({args.nodes} nodes)", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(main())
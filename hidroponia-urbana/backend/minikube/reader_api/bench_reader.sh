@@ -0,0 +1,106 @@
+#!/bin/bash
+
+# bench_reader.sh - Corre bench_concurrency.py contra los dos READER_MODE con
+# los limites del pod (250m CPU / 128Mi) y guarda los resultados
+#
+# Uso:
+#   ./bench_reader.sh                     # 200 clientes, 60 s por modo
+#   CLIENTS=400 DURATION=120 ./bench_reader.sh
+#
+# Cada corrida agrega dos lineas JSON a bench_results.jsonl: el reporte de
+# latencias (p50/p95/p99) y la memoria maxima del contenedor
+
+CLIENTS="${CLIENTS:-200}"
+DURATION="${DURATION:-60}"
+SEED_NODES="${SEED_NODES:-200}"
+RESULTS="${RESULTS:-bench_results.jsonl}"
+NETWORK=reader-bench
+IMAGE=reader-api-bench
+
+cd "$(dirname "$0")"
+
+cleanup() {
+    docker rm -f reader-bench-api reader-bench-mongo >/dev/null 2>&1
+    docker network rm "$NETWORK" >/dev/null 2>&1
+}
+trap cleanup EXIT
+
+echo "🔨 Construyendo la imagen del reader..."
+docker build -q -f Dockerfile.reader -t "$IMAGE" . >/dev/null || exit 1
+
+echo "🚀 Iniciando MongoDB..."
+docker network create "$NETWORK" >/dev/null
+docker run -d --name reader-bench-mongo --network "$NETWORK" -p 27117:27017 mongo:7 >/dev/null
+until docker exec reader-bench-mongo mongosh --quiet --eval 'db.hello().isWritablePrimary' 2>/dev/null | grep -q true; do
+    sleep 1
+done
+
+echo "🌱 Cargando 24 h de lecturas para $SEED_NODES nodos..."
+python - "$SEED_NODES" <<'EOF'
+import sys, time, random
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+
+nodes = int(sys.argv[1])
+collection = MongoClient("mongodb://localhost:27117/").hydroponics.sensor_readings
+collection.create_index([("node_id", 1), ("timestamp", -1)])
+now = time.time()
+batch = []
+for minute in range(0, 24 * 60, 5):
+    ts = now - minute * 60
+    for n in range(nodes):
+        batch.append({
+            "node_id": f"ESP32_{n:04d}",
+            "timestamp": ts,
+            "server_timestamp": datetime.utcfromtimestamp(ts),
+            "sensors": {
+                "temperature": random.gauss(22, 3),
+                "humidity": random.gauss(60, 10),
+                "ph": random.gauss(6.5, 0.5),
+                "gas": random.gauss(500, 150)
+            },
+            "irrigation_active": False
+        })
+    if len(batch) >= 10000:
+        collection.insert_many(batch)
+        batch = []
+if batch:
+    collection.insert_many(batch)
+print(f"{collection.estimated_document_count()} lecturas")
+EOF
+
+for mode in sync async; do
+    echo "📊 Benchmark READER_MODE=$mode ($CLIENTS clientes, $DURATION s)..."
+    docker run -d --name reader-bench-api --network "$NETWORK" -p 5101:5001 \
+        --cpus 0.25 --memory 128m \
+        -e READER_MODE="$mode" \
+        -e MONGODB_HEADLESS_SERVICE="mongodb://reader-bench-mongo:27017/" \
+        "$IMAGE" >/dev/null
+    until curl -sf http://localhost:5101/api/health >/dev/null; do
+        if [ "$(docker inspect -f '{{.State.Running}}' reader-bench-api)" != "true" ]; then
+            echo "❌ El reader no arranco en modo $mode:"
+            docker logs reader-bench-api
+            exit 1
+        fi
+        sleep 1
+    done
+
+    # Memoria del contenedor durante la corrida
+    (while docker stats --no-stream --format '{{.MemUsage}}' reader-bench-api 2>/dev/null; do
+        sleep 2
+    done) > "/tmp/reader-bench-mem-$mode.txt" &
+    STATS_PID=$!
+
+    python bench_concurrency.py --url http://localhost:5101 --clients "$CLIENTS" \
+        --duration "$DURATION" --label "$mode" --output "$RESULTS"
+
+    kill "$STATS_PID" 2>/dev/null
+    PEAK=$(awk '{v=$1; if (v ~ /GiB/) {sub(/GiB/, "", v); v*=1024} else sub(/MiB/, "", v); if (v+0 > max) max=v+0} END {print max}' "/tmp/reader-bench-mem-$mode.txt")
+    OOM=$(docker inspect -f '{{.State.OOMKilled}}' reader-bench-api)
+    echo "{\"label\": \"$mode\", \"peak_memory_mib\": $PEAK, \"oom_killed\": $OOM}" >> "$RESULTS"
+    echo "✅ $mode: memoria maxima ${PEAK} MiB, OOMKilled=$OOM"
+
+    docker rm -f reader-bench-api >/dev/null
+done
+
+echo "📄 Resultados en $RESULTS"
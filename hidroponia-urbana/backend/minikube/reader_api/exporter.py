@@ -0,0 +1,362 @@
+# Bulk export helpers - stream readings as compressed CSV or Parquet row groups
+import io
+import os
+import csv
+import zlib
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from queries import NODE_TIMESTAMP_INDEX, parse_time, epoch_seconds
+
+# Optional dependencies: zstd compression and Parquet output
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Parallel time slices per export; keep below the pool size
+EXPORT_MAX_SLICES = int(os.getenv('EXPORT_MAX_SLICES', 4))
+# Documents per batch; an export holds about (3 * slices + 1) batches, so
+# 4 slices of 2000 projected readings stay around 20MB within the 128Mi pod
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_MAX_BATCH_SIZE = int(os.getenv('EXPORT_MAX_BATCH_SIZE', 2000))
+
+SENSOR_FIELDS = ("temperature", "humidity", "ph", "gas")
+EXPORT_COLUMNS = ["node_id", "timestamp", "server_timestamp", *SENSOR_FIELDS,
+                  "irrigation_active", "anomaly"]
+EXPORT_PROJECTION = {
+    "_id": 0, "node_id": 1, "timestamp": 1, "server_timestamp": 1,
+    "sensors": 1, "irrigation_active": 1, "anomaly": 1
+}
+
+CSV_COMPRESSIONS = ("gzip", "zstd", "none")
+PARQUET_COMPRESSIONS = ("snappy", "gzip", "zstd", "none")
+
+_DONE = object()
+
+def parse_export_args(args):
+    """Validate /api/export parameters; raises ValueError on bad input"""
+    # node_id accepts a comma separated list; empty means every node
+    node_ids = [n for n in args.get('node_id', '').split(',') if n]
+    export_format = args.get('format', 'csv')
+    default_compression = 'gzip' if export_format == 'csv' else 'snappy'
+    compression = args.get('compression', default_compression)
+    end = parse_time(args.get('end')) or datetime.utcnow()
+    start = parse_time(args.get('start'))
+    if start is None:
+        start = end - timedelta(hours=int(args.get('hours', 24)))
+    slices = max(1, min(int(args.get('slices', 1)), EXPORT_MAX_SLICES))
+    batch_size = min(int(args.get('batch_size', EXPORT_BATCH_SIZE)), EXPORT_MAX_BATCH_SIZE)
+
+    if start >= end or batch_size <= 0:
+        raise ValueError("empty time range or batch size")
+    if export_format == 'csv':
+        if compression not in CSV_COMPRESSIONS:
+            raise ValueError(f"Unsupported CSV compression: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        suffix = {"gzip": ".csv.gz", "zstd": ".csv.zst", "none": ".csv"}[compression]
+        mimetype = {"gzip": "application/gzip", "zstd": "application/zstd", "none": "text/csv"}[compression]
+    elif export_format == 'parquet':
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(f"Unsupported Parquet compression: {compression}")
+        if pq is None:
+            raise ValueError("Parquet export requires the pyarrow package")
+        suffix = ".parquet"
+        mimetype = "application/vnd.apache.parquet"
+    else:
+        raise ValueError(f"Unsupported format: {export_format}")
+
+    return {
+        "node_ids": node_ids,
+        "format": export_format,
+        "compression": compression,
+        "start_ts": epoch_seconds(start),
+        "end_ts": epoch_seconds(end),
+        "slices": slices,
+        "batch_size": batch_size,
+        "filename": f"readings_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}{suffix}",
+        "mimetype": mimetype
+    }
+
+def node_filter(node_ids):
+    if len(node_ids) == 1:
+        return {'node_id': node_ids[0]}
+    return {'node_id': {"$in": node_ids}}
+
+def split_time_range(start, end, slices):
+    """Split [start, end) into `slices` disjoint, contiguous ranges"""
+    step = (end - start) / slices
+    bounds = [start + step * i for i in range(slices)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+def doc_to_row(doc):
+    """Flatten a reading into a tuple ordered like EXPORT_COLUMNS"""
+    sensors = doc.get("sensors") or {}
+    return (
+        doc.get("node_id"),
+        _number(doc.get("timestamp")),
+        doc.get("server_timestamp"),
+        *(_number(sensors.get(field)) for field in SENSOR_FIELDS),
+        bool(doc.get("irrigation_active", False)),
+        bool(doc.get("anomaly", False))
+    )
+
+def _slice_cursor(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+    """Batched cursor for one time slice. Slices bound the device timestamp
+    so each one is a range on the (node_id, timestamp) index rather than a
+    collection scan"""
+    slice_query = dict(query, timestamp={"$gte": start_ts, "$lt": end_ts})
+    return collection.find(slice_query, EXPORT_PROJECTION, batch_size=batch_size,
+                           **find_kwargs).hint(NODE_TIMESTAMP_INDEX)
+
+def _iter_slice(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+    """Yield lists of documents for one time slice"""
+    batch = []
+    for doc in _slice_cursor(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_batches(collection, query, start_ts, end_ts, slices=1, batch_size=1000, find_kwargs=None):
+    """Yield document batches for epoch seconds [start_ts, end_ts), fetching
+    `slices` disjoint time ranges in parallel. `query` must filter on node_id.
+    A bounded queue keeps memory flat: workers block until the response
+    consumer catches up, so about (3 * slices + 1) * batch_size documents are
+    held at most (per worker one queued batch, one being filled and the
+    cursor's fetched batch, plus the batch being encoded)."""
+    find_kwargs = find_kwargs or {}
+    if slices <= 1:
+        yield from _iter_slice(collection, query, start_ts, end_ts, batch_size, find_kwargs)
+        return
+
+    batches = queue.Queue(maxsize=slices)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(slice_start, slice_end):
+        try:
+            for batch in _iter_slice(collection, query, slice_start, slice_end, batch_size, find_kwargs):
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=slices)
+    try:
+        for slice_start, slice_end in split_time_range(start_ts, end_ts, slices):
+            # Copy the caller's context so the profiler attributes slice queries to the request
+            executor.submit(contextvars.copy_context().run, worker, slice_start, slice_end)
+
+        done = 0
+        while done < slices:
+            item = batches.get()
+            if item is _DONE:
+                done += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Also reached when the client disconnects mid-download
+        stop.set()
+        executor.shutdown(wait=False)
+
+async def _aiter_slice(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+    """Yield lists of documents for one time slice from a Motor cursor"""
+    batch = []
+    async for doc in _slice_cursor(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def aiter_batches(collection, query, start_ts, end_ts, slices=1, batch_size=1000, find_kwargs=None):
+    """iter_batches for a Motor collection: slices run as tasks on the event
+    loop and share a queue bounded the same way"""
+    find_kwargs = find_kwargs or {}
+    if slices <= 1:
+        async for batch in _aiter_slice(collection, query, start_ts, end_ts, batch_size, find_kwargs):
+            yield batch
+        return
+
+    batches = asyncio.Queue(maxsize=slices)
+
+    async def worker(slice_start, slice_end):
+        # Cancellation is not an Exception, so an abandoned export just stops
+        try:
+            async for batch in _aiter_slice(collection, query, slice_start, slice_end, batch_size, find_kwargs):
+                await batches.put(batch)
+            await batches.put(_DONE)
+        except Exception as e:
+            await batches.put(e)
+
+    tasks = [asyncio.ensure_future(worker(slice_start, slice_end))
+             for slice_start, slice_end in split_time_range(start_ts, end_ts, slices)]
+    try:
+        done = 0
+        while done < slices:
+            item = await batches.get()
+            if item is _DONE:
+                done += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Also reached when the client disconnects mid-download
+        for task in tasks:
+            task.cancel()
+
+class _NoCompression:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+def _compressor(compression):
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    return _NoCompression()
+
+class CsvEncoder:
+    """Encode document batches as a (compressed) CSV byte stream"""
+
+    def __init__(self, compression="gzip"):
+        self.compressor = _compressor(compression)
+        self.buf = io.StringIO()
+        self.writer = csv.writer(self.buf)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def _take(self):
+        data = self.buf.getvalue().encode("utf-8")
+        self.buf.seek(0)
+        self.buf.truncate(0)
+        return data
+
+    def encode(self, batch):
+        """Compressed bytes for one batch; may be empty while the compressor buffers"""
+        for doc in batch:
+            row = list(doc_to_row(doc))
+            if isinstance(row[2], datetime):
+                row[2] = row[2].isoformat()
+            self.writer.writerow(row)
+        return self.compressor.compress(self._take())
+
+    def finish(self):
+        return self.compressor.compress(self._take()) + self.compressor.flush()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the stream"""
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def parquet_schema():
+    return pa.schema([
+        ("node_id", pa.string()),
+        ("timestamp", pa.float64()),
+        ("server_timestamp", pa.timestamp("ms")),
+        *((field, pa.float64()) for field in SENSOR_FIELDS),
+        ("irrigation_active", pa.bool_()),
+        ("anomaly", pa.bool_())
+    ])
+
+class ParquetEncoder:
+    """Encode document batches as Parquet, one row group per batch"""
+
+    def __init__(self, compression="snappy"):
+        self.schema = parquet_schema()
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression=compression)
+
+    def encode(self, batch):
+        rows = [doc_to_row(doc) for doc in batch]
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(EXPORT_COLUMNS)}
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+        return self.sink.drain()
+
+    def finish(self):
+        self.writer.close()
+        return self.sink.drain()
+
+def encoder_for(export_format, compression):
+    if export_format == "parquet":
+        return ParquetEncoder(compression)
+    return CsvEncoder(compression)
+
+def encode_stream(batches, export_format, compression):
+    """Encoded byte chunks for a (sync) iterable of document batches"""
+    encoder = encoder_for(export_format, compression)
+    for batch in batches:
+        chunk = encoder.encode(batch)
+        if chunk:
+            yield chunk
+    yield encoder.finish()
+
+async def aencode_stream(batches, export_format, compression):
+    """encode_stream for an async iterable of document batches"""
+    encoder = encoder_for(export_format, compression)
+    try:
+        async for batch in batches:
+            chunk = encoder.encode(batch)
+            if chunk:
+                yield chunk
+        yield encoder.finish()
+    finally:
+        # Python 3.9 has no contextlib.aclosing; stop the slice tasks now
+        # instead of whenever the abandoned generator is collected
+        await batches.aclose()
@@ -0,0 +1,62 @@
+#!/bin/bash
+
+# local_replset.sh - Levanta un replica set local de tres miembros (rs0) con
+# procesos mongod para probar el ruteo de lecturas del reader API
+#
+# Uso:
+#   ./local_replset.sh start   # inicia los tres mongod e inicializa rs0
+#   ./local_replset.sh stop    # detiene los procesos
+#
+# Luego:
+#   export MONGODB_HEADLESS_SERVICE="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+#   python reader_api.py
+#
+# test_read_routing.py levanta su propio replica set y verifica que
+# last_values lea del primario y las consultas analiticas de un secundario
+
+BASE_DIR="${REPLSET_DIR:-/tmp/hydroponics-rs}"
+PORTS=(27017 27018 27019)
+
+start() {
+    for port in "${PORTS[@]}"; do
+        mkdir -p "$BASE_DIR/$port"
+        echo "🚀 Iniciando mongod en el puerto $port..."
+        mongod --replSet rs0 --port "$port" --bind_ip localhost \
+            --dbpath "$BASE_DIR/$port" --logpath "$BASE_DIR/$port/mongod.log" \
+            --pidfilepath "$BASE_DIR/$port/mongod.pid" --fork
+    done
+
+    echo "⚙️ Inicializando replica set rs0..."
+    mongosh --port "${PORTS[0]}" --quiet --eval '
+        rs.initiate({
+            _id: "rs0",
+            members: [
+                {_id: 0, host: "localhost:27017", priority: 2},
+                {_id: 1, host: "localhost:27018"},
+                {_id: 2, host: "localhost:27019"}
+            ]
+        })'
+
+    # Esperar a que haya un primario elegido
+    until mongosh --port "${PORTS[0]}" --quiet --eval 'db.hello().isWritablePrimary' | grep -q true; do
+        sleep 1
+    done
+
+    echo "✅ Replica set listo:"
+    mongosh --port "${PORTS[0]}" --quiet --eval 'rs.status().members.forEach(m => print(m.name, m.stateStr))'
+}
+
+stop() {
+    for port in "${PORTS[@]}"; do
+        if [ -f "$BASE_DIR/$port/mongod.pid" ]; then
+            echo "🛑 Deteniendo mongod en el puerto $port..."
+            kill "$(cat "$BASE_DIR/$port/mongod.pid")"
+        fi
+    done
+}
+
+case "$1" in
+    start) start ;;
+    stop) stop ;;
+    *) echo "Uso: $0 {start|stop}"; exit 1 ;;
+esac
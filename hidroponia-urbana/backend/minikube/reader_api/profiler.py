@@ -0,0 +1,295 @@
+# Slow-query profiler - times every MongoDB operation per endpoint and keeps
+# explain("executionStats") output for the slow ones in a ring buffer
+import os
+import time
+import queue
+import logging
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime
+from flask import request
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, make_read_preference, read_pref_mode_from_name
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 500))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv('SLOW_QUERY_BUFFER_SIZE', 100))
+# Set to "false" to record slow queries without running explain
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+# Endpoints recorded but never explained: re-running an export's scan
+# would cost as much as the export itself
+SLOW_QUERY_EXPLAIN_SKIP = set(os.getenv('SLOW_QUERY_EXPLAIN_SKIP', 'export_readings').split(','))
+# Seconds before the same query shape is explained again
+SLOW_QUERY_EXPLAIN_COOLDOWN = float(os.getenv('SLOW_QUERY_EXPLAIN_COOLDOWN', 300))
+# Explains waiting to run; further slow queries are recorded without one
+SLOW_QUERY_EXPLAIN_QUEUE = int(os.getenv('SLOW_QUERY_EXPLAIN_QUEUE', 10))
+
+# Commands that start an operation; getMore batches are added to them
+TRACKED_COMMANDS = ("find", "aggregate", "count", "distinct")
+# Fields added by the driver that explain does not accept
+DRIVER_FIELDS = ("$db", "lsid", "$clusterTime", "$readPreference", "txnNumber",
+                 "$readConcern", "readConcern", "apiVersion")
+
+logger = logging.getLogger(__name__)
+
+# State of the request being served in the current thread/context
+_current_request = contextvars.ContextVar("profiler_request", default=None)
+
+def query_shape(value):
+    """Replace literal values with "?" keeping field names and operators.
+    Arrays of literals (e.g. a $in over every node) collapse to a single "?"
+    so the shape does not grow with them; arrays of documents such as
+    pipelines or $or clauses keep one shape per element"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if not any(isinstance(item, (dict, list)) for item in value):
+            return "?"
+        return [query_shape(item) for item in value]
+    return "?"
+
+def shape_source(command_name, command):
+    """Parts of a command that identify the query, without driver options"""
+    if command_name == "aggregate":
+        return {"pipeline": command.get("pipeline", [])}
+    return {key: command.get(key) for key in ("filter", "sort", "projection", "query", "key")
+            if command.get(key) is not None}
+
+def _find_key(doc, key):
+    """First value stored under `key` anywhere in a nested explain document"""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        children = doc.values()
+    elif isinstance(doc, list):
+        children = doc
+    else:
+        return None
+    for child in children:
+        found = _find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+def _plan_stages(plan):
+    """Flatten a winning plan into its chain of stage names"""
+    stages = []
+    while isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        plan = plan.get("inputStage") or plan.get("queryPlan")
+    return stages
+
+def read_preference_of(command):
+    """Read preference the driver routed `command` with; Primary if none was sent"""
+    preference = command.get("$readPreference")
+    if not preference:
+        return Primary()
+    return make_read_preference(read_pref_mode_from_name(preference["mode"]),
+                                preference.get("tags"),
+                                preference.get("maxStalenessSeconds", -1))
+
+def summarize_explain(explain):
+    stats = _find_key(explain, "executionStats") or {}
+    return {
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_returned": stats.get("nReturned"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+        "winning_plan": _plan_stages(_find_key(explain, "winningPlan"))
+    }
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Command listener fed by pymongo; attribution to endpoints uses a
+    context variable set by the Flask request hooks"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS, buffer_size=SLOW_QUERY_BUFFER_SIZE):
+        self.threshold_ms = threshold_ms
+        self.entries = deque(maxlen=buffer_size)
+        self.endpoint_stats = {}
+        self.lock = threading.Lock()
+        self.database = None
+        # Shape key -> monotonic time of its last explain, oldest first
+        self.explained = {}
+        self.explain_queue = queue.Queue(maxsize=SLOW_QUERY_EXPLAIN_QUEUE)
+        # Started on first use, after gunicorn has forked the worker
+        self.explain_thread = None
+
+    # Flask integration
+    def init_app(self, app, database):
+        """Register the request hooks; `database` is used to run explain"""
+        self.database = database
+
+        @app.before_request
+        def start_profiling():
+            _current_request.set({
+                "endpoint": request.endpoint,
+                "params": request.args.to_dict(),
+                "started": {},
+                "cursors": {},
+                "ops": [],
+                "lock": threading.Lock()
+            })
+
+        @app.teardown_request
+        def finish_profiling(exc):
+            state = _current_request.get()
+            _current_request.set(None)
+            if state is not None:
+                self.finish_request(state)
+
+    # pymongo CommandListener interface
+    def started(self, event):
+        state = _current_request.get()
+        if state is None:
+            return
+        with state["lock"]:
+            if event.command_name in TRACKED_COMMANDS:
+                op = {
+                    "command_name": event.command_name,
+                    "collection": event.command.get(event.command_name),
+                    "shape": query_shape(shape_source(event.command_name, event.command)),
+                    # explain must run where the query ran, e.g. analytics on a secondary
+                    "read_preference": read_preference_of(event.command),
+                    "duration_ms": 0.0,
+                    "round_trips": 0
+                }
+                if self.explains(state["endpoint"]):
+                    # Kept until the request ends, only in case the op turns out slow
+                    op["command"] = {k: v for k, v in event.command.items() if k not in DRIVER_FIELDS}
+                state["ops"].append(op)
+            elif event.command_name == "getMore":
+                # getMore batches count towards the operation that opened the cursor
+                op = state["cursors"].get(event.command.get("getMore"))
+            else:
+                op = None
+            if op is not None:
+                state["started"][event.request_id] = op
+
+    def succeeded(self, event):
+        self._record(event, event.reply)
+
+    def failed(self, event):
+        self._record(event, None)
+
+    def _record(self, event, reply):
+        state = _current_request.get()
+        if state is None:
+            return
+        with state["lock"]:
+            op = state["started"].pop(event.request_id, None)
+            if op is None:
+                return
+            op["duration_ms"] += event.duration_micros / 1000
+            op["round_trips"] += 1
+            cursor = reply.get("cursor") if isinstance(reply, dict) else None
+            if isinstance(cursor, dict) and cursor.get("id"):
+                state["cursors"][cursor["id"]] = op
+
+    def explains(self, endpoint):
+        return SLOW_QUERY_EXPLAIN and self.database is not None and endpoint not in SLOW_QUERY_EXPLAIN_SKIP
+
+    def finish_request(self, state):
+        """Update per-endpoint timings and capture slow operations"""
+        endpoint = state["endpoint"] or "unknown"
+        with state["lock"]:
+            ops = list(state["ops"])
+
+        with self.lock:
+            stats = self.endpoint_stats.setdefault(endpoint, {
+                "operations": 0, "total_ms": 0.0, "max_ms": 0.0, "slow": 0
+            })
+            for op in ops:
+                stats["operations"] += 1
+                stats["total_ms"] += op["duration_ms"]
+                stats["max_ms"] = max(stats["max_ms"], op["duration_ms"])
+                if op["duration_ms"] >= self.threshold_ms:
+                    stats["slow"] += 1
+
+        for op in ops:
+            command = op.pop("command", None)
+            if op["duration_ms"] >= self.threshold_ms:
+                entry = {
+                    "captured_at": datetime.utcnow().isoformat(),
+                    "endpoint": endpoint,
+                    "params": state["params"],
+                    "operation": op["command_name"],
+                    "collection": op["collection"],
+                    "read_preference": op["read_preference"].mongos_mode,
+                    "duration_ms": round(op["duration_ms"], 1),
+                    "round_trips": op["round_trips"],
+                    "shape": op["shape"],
+                    "explain": None
+                }
+                with self.lock:
+                    self.entries.append(entry)
+                if command is not None:
+                    self._queue_explain(entry, op, command)
+                elif endpoint in SLOW_QUERY_EXPLAIN_SKIP:
+                    entry["explain"] = {"skipped": "endpoint is not explained"}
+
+    def _queue_explain(self, entry, op, command):
+        """Explain off the request path, once per shape per cooldown, and
+        only while the queue has room"""
+        key = (op["collection"], op["command_name"], op["read_preference"].mongos_mode, repr(op["shape"]))
+        now = time.monotonic()
+        with self.lock:
+            # Keys are only added when absent, so the dict stays in time order
+            for old_key in list(self.explained):
+                if now - self.explained[old_key] < SLOW_QUERY_EXPLAIN_COOLDOWN:
+                    break
+                del self.explained[old_key]
+            if key in self.explained:
+                entry["explain"] = {"skipped": "shape explained recently"}
+                return
+            self.explained[key] = now
+            if self.explain_thread is None:
+                self.explain_thread = threading.Thread(target=self._explain_loop, daemon=True)
+                self.explain_thread.start()
+
+        try:
+            self.explain_queue.put_nowait((entry, command, op["read_preference"]))
+        except queue.Full:
+            entry["explain"] = {"skipped": "explain queue full"}
+            with self.lock:
+                # Let a later occurrence of the shape try again
+                self.explained.pop(key, None)
+
+    def _explain_loop(self):
+        while True:
+            entry, command, read_preference = self.explain_queue.get()
+            self._explain(entry, command, read_preference)
+
+    def _explain(self, entry, command, read_preference):
+        started = time.perf_counter()
+        try:
+            # Database.command ignores the database's read preference, so pass
+            # the query's own; otherwise every explain re-runs on the primary
+            explain = self.database.command({"explain": command, "verbosity": "executionStats"},
+                                            read_preference=read_preference)
+            entry["explain"] = summarize_explain(explain)
+        except Exception as e:
+            entry["explain"] = {"error": str(e)}
+        logger.info(f"Explained slow {entry['operation']} on {entry['endpoint']} "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def snapshot(self):
+        """Slow queries (newest first) and per-endpoint timings"""
+        with self.lock:
+            entries = list(reversed(self.entries))
+            endpoint_stats = {
+                endpoint: dict(stats, avg_ms=round(stats["total_ms"] / stats["operations"], 1)
+                               if stats["operations"] else 0.0)
+                for endpoint, stats in self.endpoint_stats.items()
+            }
+        return {
+            "threshold_ms": self.threshold_ms,
+            "buffer_size": self.entries.maxlen,
+            "entries": entries,
+            "endpoint_stats": endpoint_stats
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.endpoint_stats.clear()
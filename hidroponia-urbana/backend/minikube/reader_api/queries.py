@@ -0,0 +1,372 @@
+# Query definitions shared by the sync (Flask) and async (Quart) reader APIs
+import os
+from datetime import datetime, timedelta, timezone
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+DATABASE_NAME = "hydroponics"
+SENSOR_COLLECTION = "sensor_readings"
+STATUS_COLLECTION = "node_status"
+COMMAND_COLLECTION = "irrigation_commands"
+
+# Max replication lag (seconds) accepted when reading from a secondary.
+# MongoDB requires at least 90; -1 disables the check
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv('MONGO_MAX_STALENESS_SECONDS', 120))
+
+# Cost classes: cheap "latest" reads stay on the primary, heavy "analytics"
+# reads go to secondaries so they don't compete with the writer's inserts
+READ_PREFERENCES = {
+    "latest": Primary(),
+    "analytics": SecondaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS)
+}
+
+# Per-endpoint routing, server-side time limit and disk spill policy
+ENDPOINT_POLICIES = {
+    "last_values": {
+        "cost_class": "latest",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_LAST_VALUES', 2000)),
+        "allow_disk_use": False
+    },
+    "nodes": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_NODES', 10000)),
+        "allow_disk_use": False
+    },
+    "history": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_HISTORY', 15000)),
+        "allow_disk_use": True
+    },
+    "statistics": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_STATISTICS', 30000)),
+        "allow_disk_use": True
+    },
+    "alerts": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_ALERTS', 10000)),
+        "allow_disk_use": False
+    },
+    "anomalies": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_ANOMALIES', 10000)),
+        "allow_disk_use": False
+    },
+    # Command state is written by the command service; read it fresh
+    "commands": {
+        "cost_class": "latest",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_COMMANDS', 5000)),
+        "allow_disk_use": False
+    },
+    "compare": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_COMPARE', 10000)),
+        "allow_disk_use": False
+    },
+    # Unsorted scan, so no disk spill; the limit covers the whole cursor and
+    # stays below the gunicorn --timeout (300 s) set in Dockerfile.reader
+    "export": {
+        "cost_class": "analytics",
+        "max_time_ms": int(os.getenv('MAX_TIME_MS_EXPORT', 240000)),
+        "allow_disk_use": False
+    }
+}
+
+def routed_collections(collection):
+    """One view of `collection` per cost class, with its read preference"""
+    return {
+        cost_class: collection.with_options(read_preference=preference)
+        for cost_class, preference in READ_PREFERENCES.items()
+    }
+
+def collection_for(routes, endpoint):
+    """Pick the routed collection view for an endpoint's cost class"""
+    return routes[ENDPOINT_POLICIES[endpoint]["cost_class"]]
+
+def aggregate_options(endpoint):
+    """Keyword arguments for aggregate() under the endpoint's policy"""
+    policy = ENDPOINT_POLICIES[endpoint]
+    return {"maxTimeMS": policy["max_time_ms"], "allowDiskUse": policy["allow_disk_use"]}
+
+def find_options(endpoint):
+    """Keyword arguments for find() under the endpoint's policy"""
+    policy = ENDPOINT_POLICIES[endpoint]
+    return {"max_time_ms": policy["max_time_ms"], "allow_disk_use": policy["allow_disk_use"]}
+
+SENSOR_TYPES = ("temperature", "humidity", "ph", "gas")
+
+# Limits for /api/compare
+COMPARE_MAX_NODES = int(os.getenv('COMPARE_MAX_NODES', 50))
+COMPARE_MAX_POINTS = int(os.getenv('COMPARE_MAX_POINTS', 1000))
+COMPARE_DEFAULT_POINTS = 200
+
+# Index created by the writer on sensor_readings
+NODE_TIMESTAMP_INDEX = [("node_id", 1), ("timestamp", -1)]
+
+# Alert thresholds
+ALERT_THRESHOLDS = {
+    "temperature": {"min": 15, "max": 30},
+    "humidity": {"min": 30, "max": 90},
+    "ph": {"min": 5.0, "max": 8.0},
+    "gas": {"min": 200, "max": 1000}
+}
+
+# Sanitize MongoDB documents for JSON serialization
+def sanitize_mongo_doc(doc):
+    doc['_id'] = str(doc.get('_id'))
+
+    # Convierte timestamp si es datetime
+    if 'timestamp' in doc and isinstance(doc['timestamp'], datetime):
+        doc['timestamp'] = doc['timestamp'].isoformat()
+    elif 'timestamp' in doc:
+        # Si es un float, lo convertimos a datetime primero
+        try:
+            doc['timestamp'] = datetime.utcfromtimestamp(doc['timestamp']).isoformat()
+        except Exception:
+            # Si no se puede convertir, lo dejamos como está
+            pass
+    return doc
+
+def parse_time(value):
+    """Parse an ISO 8601 datetime or epoch seconds as naive UTC; None if not given"""
+    if not value:
+        return None
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        pass
+    # fromisoformat only accepts "Z" from Python 3.11
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # Naive UTC like utcnow() and the stored server_timestamp values
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def epoch_seconds(value):
+    """Naive UTC datetime to epoch seconds, the unit of device timestamps"""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+def nodes_pipeline():
+    """Unique node IDs seen in the last 24 hours"""
+    since = datetime.utcnow() - timedelta(hours=24)
+    return [
+        {"$match": {"server_timestamp": {"$gte": since}}},
+        {"$group": {"_id": "$node_id", "last_seen": {"$max": "$server_timestamp"}}},
+        {"$sort": {"last_seen": -1}}
+    ]
+
+def last_values_pipeline(node_id=None):
+    """Most recent reading for each node, or for a single node"""
+    match_criteria = {}
+    if node_id:
+        match_criteria['node_id'] = node_id
+
+    return [
+        {"$match": match_criteria},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": "$node_id",
+            "latest_reading": {"$first": "$$ROOT"}
+        }},
+        {"$replaceRoot": {"newRoot": "$latest_reading"}},
+        {"$sort": {"timestamp": -1}}
+    ]
+
+def history_query(node_id, hours):
+    """Filter for historical readings of the last `hours` hours"""
+    query = {}
+    if node_id:
+        query['node_id'] = node_id
+
+    # Time range filter
+    since = datetime.utcnow() - timedelta(hours=hours)
+    query['server_timestamp'] = {"$gte": since}
+    return query
+
+def filter_sensor_type(readings, sensor_type):
+    """Keep only the requested sensor type in each reading"""
+    if sensor_type and readings:
+        for reading in readings:
+            if 'sensors' in reading and sensor_type in reading['sensors']:
+                reading['sensors'] = {sensor_type: reading['sensors'][sensor_type]}
+    return readings
+
+def statistics_pipeline(node_id, hours):
+    """Statistical summary per node over the last `hours` hours.
+    Summary messages count as window.samples readings, with min/max taken
+    from their window and their means weighted by sample count"""
+    match_criteria = {}
+    if node_id:
+        match_criteria['node_id'] = node_id
+
+    # Time range filter
+    since = datetime.utcnow() - timedelta(hours=hours)
+    match_criteria['server_timestamp'] = {"$gte": since}
+
+    weight = {"$ifNull": ["$window.samples", 1]}
+    group = {
+        "_id": "$node_id",
+        "count": {"$sum": weight},
+        "first_reading": {"$min": "$server_timestamp"},
+        "last_reading": {"$max": "$server_timestamp"}
+    }
+    averages = {}
+    for sensor in SENSOR_TYPES:
+        value = f"$sensors.{sensor}"
+        group[f"_sum_{sensor}"] = {"$sum": {"$cond": [{"$isNumber": value}, {"$multiply": [value, weight]}, 0]}}
+        group[f"_n_{sensor}"] = {"$sum": {"$cond": [{"$isNumber": value}, weight, 0]}}
+        group[f"min_{sensor}"] = {"$min": {"$ifNull": [f"$summary.{sensor}.min", value]}}
+        group[f"max_{sensor}"] = {"$max": {"$ifNull": [f"$summary.{sensor}.max", value]}}
+        averages[f"avg_{sensor}"] = {"$cond": [
+            {"$gt": [f"$_n_{sensor}", 0]},
+            {"$divide": [f"$_sum_{sensor}", f"$_n_{sensor}"]},
+            None
+        ]}
+
+    return [
+        {"$match": match_criteria},
+        {"$group": group},
+        {"$addFields": averages},
+        {"$project": {f"{prefix}_{sensor}": 0 for sensor in SENSOR_TYPES for prefix in ("_sum", "_n")}}
+    ]
+
+def alerts_query(hours):
+    """Readings with at least one sensor outside ALERT_THRESHOLDS"""
+    since = datetime.utcnow() - timedelta(hours=hours)
+
+    # Build query for out-of-range values
+    alert_conditions = []
+    for sensor, limits in ALERT_THRESHOLDS.items():
+        alert_conditions.extend([
+            {f"sensors.{sensor}": {"$lt": limits["min"]}},
+            {f"sensors.{sensor}": {"$gt": limits["max"]}},
+            # Summaries: an excursion inside the window shows in its min/max
+            {f"summary.{sensor}.min": {"$lt": limits["min"]}},
+            {f"summary.{sensor}.max": {"$gt": limits["max"]}}
+        ])
+
+    return {
+        "server_timestamp": {"$gte": since},
+        "$or": alert_conditions
+    }
+
+def add_alert_types(alert):
+    """Add the list of threshold violations to an alert reading"""
+    alert['alert_types'] = []
+    summary = alert.get('summary') or {}
+    if 'sensors' in alert:
+        for sensor, value in alert['sensors'].items():
+            if sensor in ALERT_THRESHOLDS:
+                limits = ALERT_THRESHOLDS[sensor]
+                low = summary.get(sensor, {}).get("min", value)
+                high = summary.get(sensor, {}).get("max", value)
+                if low < limits["min"]:
+                    alert['alert_types'].append(f"{sensor}_low")
+                if high > limits["max"]:
+                    alert['alert_types'].append(f"{sensor}_high")
+    return alert
+
+def anomalies_query(node_id, anomaly_type, hours):
+    """Readings flagged by the writer's anomaly detector"""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    query = {
+        "anomaly": True,
+        "server_timestamp": {"$gte": since}
+    }
+    if node_id:
+        query['node_id'] = node_id
+    if anomaly_type:
+        query['anomalies.type'] = anomaly_type
+    return query
+
+def parse_compare_args(args):
+    """Validate /api/compare parameters; raises ValueError on bad input"""
+    node_ids = list(dict.fromkeys(n for n in args.get('node_id', '').split(',') if n))
+    sensors = [s for s in args.get('sensors', ','.join(SENSOR_TYPES)).split(',') if s]
+    if not node_ids or len(node_ids) > COMPARE_MAX_NODES:
+        raise ValueError(f"between 1 and {COMPARE_MAX_NODES} node_id values are required")
+    if not sensors or any(s not in SENSOR_TYPES for s in sensors):
+        raise ValueError(f"sensors must be a subset of {', '.join(SENSOR_TYPES)}")
+
+    end = parse_time(args.get('end')) or datetime.utcnow()
+    start = parse_time(args.get('start')) or end - timedelta(hours=int(args.get('hours', 24)))
+    # Device timestamps are epoch seconds (UTC)
+    start_ts = epoch_seconds(start)
+    end_ts = epoch_seconds(end)
+    if end_ts <= start_ts:
+        raise ValueError("start must be before end")
+
+    if args.get('step'):
+        step = float(args['step'])
+    else:
+        step = max(60.0, (end_ts - start_ts) / COMPARE_DEFAULT_POINTS)
+    if step <= 0:
+        raise ValueError("step must be positive")
+    points = int(-(-(end_ts - start_ts) // step))
+    if points > COMPARE_MAX_POINTS:
+        raise ValueError(f"time grid exceeds {COMPARE_MAX_POINTS} points, increase step")
+
+    return {
+        "node_ids": node_ids,
+        "sensors": sensors,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "step": step,
+        "points": points
+    }
+
+def compare_grid(start_ts, step, points):
+    """ISO timestamps for the start of each grid bucket"""
+    return [datetime.utcfromtimestamp(start_ts + i * step).isoformat() for i in range(points)]
+
+def compare_query(node_id, start_ts, end_ts):
+    """Range filter for one node, served by the (node_id, timestamp) index"""
+    return {"node_id": node_id, "timestamp": {"$gte": start_ts, "$lt": end_ts}}
+
+def compare_projection(sensors):
+    return {"_id": 0, "timestamp": 1, **{f"sensors.{sensor}": 1 for sensor in sensors}}
+
+class GridAccumulator:
+    """Running per-bucket averages of one node's readings, so a cursor can
+    be folded in as it is iterated instead of being loaded first"""
+
+    def __init__(self, sensors, start_ts, step, points):
+        self.sensors = sensors
+        self.start_ts = start_ts
+        self.step = step
+        self.points = points
+        self.sums = {sensor: [0.0] * points for sensor in sensors}
+        self.counts = {sensor: [0] * points for sensor in sensors}
+
+    def add(self, reading):
+        ts = reading.get('timestamp')
+        if not isinstance(ts, (int, float)):
+            return
+        bucket = int((ts - self.start_ts) // self.step)
+        if not 0 <= bucket < self.points:
+            return
+        values = reading.get('sensors') or {}
+        for sensor in self.sensors:
+            value = values.get(sensor)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.sums[sensor][bucket] += value
+                self.counts[sensor][bucket] += 1
+
+    def result(self):
+        """{sensor: [value or None per bucket]}"""
+        return {
+            sensor: [
+                round(self.sums[sensor][i] / self.counts[sensor][i], 3) if self.counts[sensor][i] else None
+                for i in range(self.points)
+            ]
+            for sensor in self.sensors
+        }
+
+def align_to_grid(readings, sensors, start_ts, step, points):
+    """Average one node's readings into `points` buckets of `step` seconds.
+    Returns {sensor: [value or None per bucket]}"""
+    grid = GridAccumulator(sensors, start_ts, step, points)
+    for reading in readings:
+        grid.add(reading)
+    return grid.result()
@@ -1,34 +1,60 @@
 # Reader Backend - Flask API for querying sensor data
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from pymongo import MongoClient
+from pymongo.errors import ExecutionTimeout
 from datetime import datetime, timedelta
 import logging
 from bson import ObjectId
 import json
+from queries import (
+    DATABASE_NAME, SENSOR_COLLECTION, STATUS_COLLECTION, COMMAND_COLLECTION, ALERT_THRESHOLDS,
+    sanitize_mongo_doc, nodes_pipeline, last_values_pipeline, history_query,
+    filter_sensor_type, statistics_pipeline, alerts_query, add_alert_types,
+    anomalies_query, routed_collections, collection_for, aggregate_options,
+    find_options, parse_compare_args, compare_grid,
+    compare_query, compare_projection, align_to_grid, NODE_TIMESTAMP_INDEX,
+    ENDPOINT_POLICIES
+)
+import exporter
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from profiler import SlowQueryProfiler
 
 # Configuration
 MONGODB_URI = os.getenv('MONGODB_HEADLESS_SERVICE')
-DATABASE_NAME = "hydroponics"
-SENSOR_COLLECTION = "sensor_readings"
-STATUS_COLLECTION = "node_status"
+# Max connections per process in the MongoDB pool
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 10))
+# Concurrent per-node queries for /api/compare
+COMPARE_MAX_WORKERS = int(os.getenv('COMPARE_MAX_WORKERS', 8))
+# /api/debug/slow-queries exposes request params and query shapes; off unless set to "true"
+SLOW_QUERY_ENDPOINT = os.getenv('SLOW_QUERY_ENDPOINT', 'false').lower() == 'true'
 
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend access
+# Enable CORS for frontend access; the debug endpoints stay same-origin
+CORS(app, resources={r"/api/(?!debug/).*": {"origins": "*"}})
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # MongoDB connection
+# connect=False defers opening sockets until the first operation, so each
+# gunicorn worker builds its own pool after the fork
+# Every command goes through the slow-query profiler (see /api/debug/slow-queries)
+slow_query_profiler = SlowQueryProfiler()
 try:
-    mongo_client = MongoClient(MONGODB_URI)
+    mongo_client = MongoClient(MONGODB_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, connect=False,
+                               event_listeners=[slow_query_profiler])
     db = mongo_client[DATABASE_NAME]
     sensor_collection = db[SENSOR_COLLECTION]
     status_collection = db[STATUS_COLLECTION]
-    logger.info("Connected to MongoDB successfully")
+    # Per cost class views: latest values from the primary, analytics from secondaries
+    sensor_routes = routed_collections(sensor_collection)
+    command_routes = routed_collections(db[COMMAND_COLLECTION])
+    logger.info("MongoDB client configured successfully")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     raise
@@ -41,24 +67,12 @@ class JSONEncoder(json.JSONEncoder):
         if isinstance(obj, datetime):
             return obj.isoformat()
         return super().default(obj)
-    
-# Sanitize MongoDB documents for JSON serialization
-def sanitize_mongo_doc(doc):
-    doc['_id'] = str(doc.get('_id'))
-    
-    # Convierte timestamp si es datetime
-    if 'timestamp' in doc and isinstance(doc['timestamp'], datetime):
-        doc['timestamp'] = doc['timestamp'].isoformat()
-    elif 'timestamp' in doc:
-        # Si es un float, lo convertimos a datetime primero
-        try:
-            doc['timestamp'] = datetime.utcfromtimestamp(doc['timestamp']).isoformat()
-        except Exception:
-            # Si no se puede convertir, lo dejamos como está
-            pass
-    return doc
 
 app.json_encoder = JSONEncoder
+slow_query_profiler.init_app(app, db)
+
+# Threads are only started on first use, so this is safe to create before gunicorn forks
+compare_executor = ThreadPoolExecutor(max_workers=COMPARE_MAX_WORKERS)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -83,21 +97,16 @@ def get_nodes():
     """Get list of all active nodes"""
     try:
         # Get unique node IDs from recent data (last 24 hours)
-        since = datetime.utcnow() - timedelta(hours=24)
-        
-        pipeline = [
-            {"$match": {"server_timestamp": {"$gte": since}}},
-            {"$group": {"_id": "$node_id", "last_seen": {"$max": "$server_timestamp"}}},
-            {"$sort": {"last_seen": -1}}
-        ]
-        
-        nodes = list(sensor_collection.aggregate(pipeline))
-        
+        nodes = list(collection_for(sensor_routes, 'nodes').aggregate(
+            nodes_pipeline(), **aggregate_options('nodes')))
+
         return jsonify({
             "nodes": [{"node_id": node["_id"], "last_seen": node["last_seen"]} for node in nodes],
             "count": len(nodes)
         })
-        
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
     except Exception as e:
         logger.error(f"Error getting nodes: {e}")
         return jsonify({"error": str(e)}), 500
@@ -107,33 +116,20 @@ def get_last_values():
     """Get the most recent sensor values for all nodes or specific node"""
     try:
         node_id = request.args.get('node_id')
-        
-        # Build match criteria
-        match_criteria = {}
-        if node_id:
-            match_criteria['node_id'] = node_id
-        
+
         # Get the most recent reading for each node
-        pipeline = [
-            {"$match": match_criteria},
-            {"$sort": {"timestamp": -1}},
-            {"$group": {
-                "_id": "$node_id",
-                "latest_reading": {"$first": "$$ROOT"}
-            }},
-            {"$replaceRoot": {"newRoot": "$latest_reading"}},
-            {"$sort": {"timestamp": -1}}
-        ]
-        
-        readings = list(sensor_collection.aggregate(pipeline))
+        readings = list(collection_for(sensor_routes, 'last_values').aggregate(
+            last_values_pipeline(node_id), **aggregate_options('last_values')))
         sanitized = [sanitize_mongo_doc(r) for r in readings]
 
         return jsonify({
-            "readings": readings,
-            "count": len(readings),
+            "readings": sanitized,
+            "count": len(sanitized),
             "timestamp": datetime.utcnow().isoformat()
         })
-        
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
     except Exception as e:
         logger.error(f"Error getting last values: {e}")
         return jsonify({"error": str(e)}), 500
@@ -147,27 +143,12 @@ def get_history():
         sensor_type = request.args.get('sensor_type')  # temperature, humidity, ph, gas
         hours = int(request.args.get('hours', 24))  # Default last 24 hours
         limit = int(request.args.get('limit', 100))  # Default limit 100 records
-        
-        # Build query
-        query = {}
-        if node_id:
-            query['node_id'] = node_id
-        
-        # Time range filter
-        since = datetime.utcnow() - timedelta(hours=hours)
-        query['server_timestamp'] = {"$gte": since}
-        
+
         # Execute query
-        cursor = sensor_collection.find(query).sort("timestamp", -1).limit(limit)
-        readings = list(cursor)
-        
-        # Filter by sensor type if specified
-        if sensor_type and readings:
-            for reading in readings:
-                if 'sensors' in reading and sensor_type in reading['sensors']:
-                    # Keep only the requested sensor type
-                    reading['sensors'] = {sensor_type: reading['sensors'][sensor_type]}
-        
+        cursor = collection_for(sensor_routes, 'history').find(
+            history_query(node_id, hours), **find_options('history')).sort("timestamp", -1).limit(limit)
+        readings = filter_sensor_type(list(cursor), sensor_type)
+
         # Sanitize readings
         sanitized_readings = [sanitize_mongo_doc(r) for r in readings]
 
@@ -182,9 +163,11 @@ def get_history():
             },
             "timestamp": datetime.utcnow().isoformat()
         })
-        
+
     except ValueError as e:
         return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
     except Exception as e:
         logger.error(f"Error getting history: {e}")
         return jsonify({"error": str(e)}), 500
@@ -195,49 +178,21 @@ def get_statistics():
     try:
         node_id = request.args.get('node_id')
         hours = int(request.args.get('hours', 24))
-        
-        # Build match criteria
-        match_criteria = {}
-        if node_id:
-            match_criteria['node_id'] = node_id
-        
-        # Time range filter
-        since = datetime.utcnow() - timedelta(hours=hours)
-        match_criteria['server_timestamp'] = {"$gte": since}
-        
+
         # Aggregation pipeline for statistics
-        pipeline = [
-            {"$match": match_criteria},
-            {"$group": {
-                "_id": "$node_id",
-                "count": {"$sum": 1},
-                "avg_temperature": {"$avg": "$sensors.temperature"},
-                "min_temperature": {"$min": "$sensors.temperature"},
-                "max_temperature": {"$max": "$sensors.temperature"},
-                "avg_humidity": {"$avg": "$sensors.humidity"},
-                "min_humidity": {"$min": "$sensors.humidity"},
-                "max_humidity": {"$max": "$sensors.humidity"},
-                "avg_ph": {"$avg": "$sensors.ph"},
-                "min_ph": {"$min": "$sensors.ph"},
-                "max_ph": {"$max": "$sensors.ph"},
-                "avg_gas": {"$avg": "$sensors.gas"},
-                "min_gas": {"$min": "$sensors.gas"},
-                "max_gas": {"$max": "$sensors.gas"},
-                "first_reading": {"$min": "$server_timestamp"},
-                "last_reading": {"$max": "$server_timestamp"}
-            }}
-        ]
-        
-        stats = list(sensor_collection.aggregate(pipeline))
-        
+        stats = list(collection_for(sensor_routes, 'statistics').aggregate(
+            statistics_pipeline(node_id, hours), **aggregate_options('statistics')))
+
         return jsonify({
             "statistics": stats,
             "period_hours": hours,
             "timestamp": datetime.utcnow().isoformat()
         })
-        
+
     except ValueError as e:
         return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
     except Exception as e:
         logger.error(f"Error getting statistics: {e}")
         return jsonify({"error": str(e)}), 500
@@ -247,58 +202,199 @@ def get_alerts():
     """Get sensor readings that exceed normal thresholds"""
     try:
         hours = int(request.args.get('hours', 24))
-        
-        # Define alert thresholds
-        thresholds = {
-            "temperature": {"min": 15, "max": 30},
-            "humidity": {"min": 30, "max": 90},
-            "ph": {"min": 5.0, "max": 8.0},
-            "gas": {"min": 200, "max": 1000}
-        }
-        
-        # Time range filter
-        since = datetime.utcnow() - timedelta(hours=hours)
-        
-        # Build query for out-of-range values
-        alert_conditions = []
-        for sensor, limits in thresholds.items():
-            alert_conditions.extend([
-                {f"sensors.{sensor}": {"$lt": limits["min"]}},
-                {f"sensors.{sensor}": {"$gt": limits["max"]}}
-            ])
-        
-        query = {
-            "server_timestamp": {"$gte": since},
-            "$or": alert_conditions
-        }
-        
-        alerts = list(sensor_collection.find(query).sort("timestamp", -1).limit(50))
-        
+
+        alerts = list(collection_for(sensor_routes, 'alerts').find(
+            alerts_query(hours), **find_options('alerts')).sort("timestamp", -1).limit(50))
+
         # Add alert type to each reading
-        for alert in alerts:
-            alert['alert_types'] = []
-            if 'sensors' in alert:
-                for sensor, value in alert['sensors'].items():
-                    if sensor in thresholds:
-                        limits = thresholds[sensor]
-                        if value < limits["min"]:
-                            alert['alert_types'].append(f"{sensor}_low")
-                        elif value > limits["max"]:
-                            alert['alert_types'].append(f"{sensor}_high")
-        
+        alerts = [sanitize_mongo_doc(add_alert_types(alert)) for alert in alerts]
+
         return jsonify({
             "alerts": alerts,
             "count": len(alerts),
-            "thresholds": thresholds,
+            "thresholds": ALERT_THRESHOLDS,
             "period_hours": hours,
             "timestamp": datetime.utcnow().isoformat()
         })
-        
+
     except ValueError as e:
         return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
     except Exception as e:
         logger.error(f"Error getting alerts: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/anomalies', methods=['GET'])
+def get_anomalies():
+    """Get readings flagged by the writer's streaming anomaly detector"""
+    try:
+        node_id = request.args.get('node_id')
+        anomaly_type = request.args.get('type')  # zscore, rate, stuck
+        hours = int(request.args.get('hours', 24))
+        limit = int(request.args.get('limit', 100))
+
+        query = anomalies_query(node_id, anomaly_type, hours)
+        cursor = collection_for(sensor_routes, 'anomalies').find(
+            query, **find_options('anomalies')).sort("server_timestamp", -1).limit(limit)
+        anomalies = [sanitize_mongo_doc(r) for r in cursor]
+
+        return jsonify({
+            "anomalies": anomalies,
+            "count": len(anomalies),
+            "filters": {
+                "node_id": node_id,
+                "type": anomaly_type,
+                "hours": hours,
+                "limit": limit
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting anomalies: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_readings():
+    """Stream a node/time-range selection as compressed CSV or Parquet"""
+    try:
+        try:
+            params = exporter.parse_export_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        collection = collection_for(sensor_routes, 'export')
+        node_ids = params['node_ids']
+        if not node_ids:
+            # Every node, listed from the (node_id, timestamp) index so each
+            # slice is still an index range instead of a collection scan
+            node_ids = collection.distinct(
+                'node_id', maxTimeMS=ENDPOINT_POLICIES['export']['max_time_ms'])
+
+        batches = exporter.iter_batches(
+            collection, exporter.node_filter(node_ids), params['start_ts'], params['end_ts'],
+            slices=params['slices'], batch_size=params['batch_size'], find_kwargs=find_options('export')
+        )
+        body = exporter.encode_stream(batches, params['format'], params['compression'])
+
+        def generate():
+            try:
+                yield from body
+            except Exception as e:
+                # Headers are already sent, the client sees a truncated file
+                logger.error(f"Error streaming export: {e}")
+                raise
+
+        # Keep the request context (and its profiler state) until the stream
+        # closes; teardown_request then runs after the last batch
+        return Response(stream_with_context(generate()), mimetype=params['mimetype'], headers={
+            "Content-Disposition": f"attachment; filename={params['filename']}"
+        })
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error exporting readings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/commands', methods=['GET'])
+def get_commands():
+    """Get the most recent irrigation commands with their state and latencies"""
+    try:
+        limit = int(request.args.get('limit', 20))
+
+        # Per-node detail is left out of the listing
+        cursor = collection_for(command_routes, 'commands').find(
+            {}, {"nodes": 0}, **find_options('commands')).sort("created_at", -1).limit(limit)
+        commands = list(cursor)
+
+        return jsonify({
+            "commands": commands,
+            "count": len(commands),
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting commands: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/commands/<command_id>', methods=['GET'])
+def get_command(command_id):
+    """Get one irrigation command, optionally with the state of every node"""
+    try:
+        include_nodes = request.args.get('include_nodes', 'false').lower() == 'true'
+        projection = None if include_nodes else {"nodes": 0}
+
+        command = collection_for(command_routes, 'commands').find_one(
+            {"_id": command_id}, projection, **find_options('commands'))
+        if command is None:
+            return jsonify({"error": "Command not found"}), 404
+
+        return jsonify(command)
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting command: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/compare', methods=['GET'])
+def compare_nodes():
+    """Compare several nodes on a common time grid, one range query per node"""
+    try:
+        try:
+            params = parse_compare_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        collection = collection_for(sensor_routes, 'compare')
+        sensors = params['sensors']
+
+        def fetch(node_id):
+            # One indexed range scan per node instead of a single $in scan
+            cursor = collection.find(
+                compare_query(node_id, params['start_ts'], params['end_ts']),
+                compare_projection(sensors), **find_options('compare')
+            ).hint(NODE_TIMESTAMP_INDEX)
+            return align_to_grid(cursor, sensors, params['start_ts'], params['step'], params['points'])
+
+        # Copy the request context so the profiler attributes each query to this endpoint
+        futures = [compare_executor.submit(contextvars.copy_context().run, fetch, node_id)
+                   for node_id in params['node_ids']]
+        columns = dict(zip(params['node_ids'], (future.result() for future in futures)))
+
+        return jsonify({
+            "grid": compare_grid(params['start_ts'], params['step'], params['points']),
+            "step_seconds": params['step'],
+            "sensors": sensors,
+            "columns": columns,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error comparing nodes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/debug/slow-queries', methods=['GET', 'DELETE'])
+def get_slow_queries():
+    """Slow MongoDB operations with their explain output, and per-endpoint timings"""
+    if not SLOW_QUERY_ENDPOINT:
+        return jsonify({"error": "Not found"}), 404
+    if request.method == 'DELETE':
+        slow_query_profiler.clear()
+        return jsonify({"status": "cleared"})
+    return jsonify(slow_query_profiler.snapshot())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
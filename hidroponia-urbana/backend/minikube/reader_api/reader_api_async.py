@@ -0,0 +1,393 @@
+# Reader Backend - async (ASGI) version of the reader API using Quart + Motor
+# Run with: gunicorn -k uvicorn.workers.UvicornWorker reader_api_async:app
+import os
+import asyncio
+import logging
+from datetime import datetime
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ExecutionTimeout
+from queries import (
+    DATABASE_NAME, SENSOR_COLLECTION, STATUS_COLLECTION, COMMAND_COLLECTION, ALERT_THRESHOLDS,
+    sanitize_mongo_doc, nodes_pipeline, last_values_pipeline, history_query,
+    filter_sensor_type, statistics_pipeline, alerts_query, add_alert_types,
+    anomalies_query, routed_collections, collection_for, aggregate_options,
+    find_options, parse_compare_args, compare_grid, compare_query,
+    compare_projection, GridAccumulator, NODE_TIMESTAMP_INDEX, ENDPOINT_POLICIES
+)
+import exporter
+
+# Configuration
+MONGODB_URI = os.getenv('MONGODB_HEADLESS_SERVICE')
+# Max connections per process; one event loop shares the whole pool
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+# Requests processed at once per worker; the rest wait holding only their
+# connection. Unbounded, 200 clients each holding a decoded result while
+# waiting for CPU exceeded the 128Mi pod limit (see bench_results.jsonl)
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 16))
+
+
+class ConcurrencyLimit:
+    """ASGI middleware that queues HTTP requests beyond `limit` in flight"""
+
+    def __init__(self, asgi_app, limit):
+        self.asgi_app = asgi_app
+        self.limit = limit
+        self.slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.asgi_app(scope, receive, send)
+        if self.slots is None:
+            # Created on first use so it belongs to the worker's event loop
+            self.slots = asyncio.Semaphore(self.limit)
+        async with self.slots:
+            await self.asgi_app(scope, receive, send)
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")  # Enable CORS for frontend access
+app.asgi_app = ConcurrencyLimit(app.asgi_app, MAX_CONCURRENT_REQUESTS)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MongoDB connection, created per worker process once its event loop is running
+mongo_client = None
+sensor_collection = None
+status_collection = None
+sensor_routes = None
+command_routes = None
+
+@app.before_serving
+async def connect_mongodb():
+    """Open the Motor client inside the worker's event loop"""
+    global mongo_client, sensor_collection, status_collection, sensor_routes, command_routes
+    mongo_client = AsyncIOMotorClient(MONGODB_URI, maxPoolSize=MONGO_MAX_POOL_SIZE)
+    db = mongo_client[DATABASE_NAME]
+    sensor_collection = db[SENSOR_COLLECTION]
+    status_collection = db[STATUS_COLLECTION]
+    # Per cost class views: latest values from the primary, analytics from secondaries
+    sensor_routes = routed_collections(sensor_collection)
+    command_routes = routed_collections(db[COMMAND_COLLECTION])
+    logger.info(f"MongoDB client ready (pid {os.getpid()}, pool size {MONGO_MAX_POOL_SIZE})")
+
+@app.after_serving
+async def close_mongodb():
+    """Close the Motor client when the worker shuts down"""
+    if mongo_client is not None:
+        mongo_client.close()
+        logger.info("MongoDB client closed")
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    try:
+        # Test MongoDB connection
+        await mongo_client.admin.command('ping')
+        return jsonify({
+            "status": "healthy",
+            "service": "reader_api",
+            "mode": "async",
+            "timestamp": datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "unhealthy",
+            "error": str(e),
+            "timestamp": datetime.utcnow().isoformat()
+        }), 500
+
+@app.route('/api/nodes', methods=['GET'])
+async def get_nodes():
+    """Get list of all active nodes"""
+    try:
+        nodes = await collection_for(sensor_routes, 'nodes').aggregate(
+            nodes_pipeline(), **aggregate_options('nodes')).to_list(None)
+
+        return jsonify({
+            "nodes": [{"node_id": node["_id"], "last_seen": node["last_seen"]} for node in nodes],
+            "count": len(nodes)
+        })
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting nodes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/last-values', methods=['GET'])
+async def get_last_values():
+    """Get the most recent sensor values for all nodes or specific node"""
+    try:
+        node_id = request.args.get('node_id')
+
+        readings = await collection_for(sensor_routes, 'last_values').aggregate(
+            last_values_pipeline(node_id), **aggregate_options('last_values')).to_list(None)
+        sanitized = [sanitize_mongo_doc(r) for r in readings]
+
+        return jsonify({
+            "readings": sanitized,
+            "count": len(sanitized),
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting last values: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/history', methods=['GET'])
+async def get_history():
+    """Get historical sensor data with filtering options"""
+    try:
+        node_id = request.args.get('node_id')
+        sensor_type = request.args.get('sensor_type')
+        hours = int(request.args.get('hours', 24))
+        limit = int(request.args.get('limit', 100))
+
+        cursor = collection_for(sensor_routes, 'history').find(
+            history_query(node_id, hours), **find_options('history')).sort("timestamp", -1).limit(limit)
+        readings = filter_sensor_type(await cursor.to_list(None), sensor_type)
+        sanitized_readings = [sanitize_mongo_doc(r) for r in readings]
+
+        return jsonify({
+            "readings": sanitized_readings,
+            "count": len(sanitized_readings),
+            "filters": {
+                "node_id": node_id,
+                "sensor_type": sensor_type,
+                "hours": hours,
+                "limit": limit
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting history: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/statistics', methods=['GET'])
+async def get_statistics():
+    """Get statistical summary of sensor data"""
+    try:
+        node_id = request.args.get('node_id')
+        hours = int(request.args.get('hours', 24))
+
+        stats = await collection_for(sensor_routes, 'statistics').aggregate(
+            statistics_pipeline(node_id, hours), **aggregate_options('statistics')).to_list(None)
+
+        return jsonify({
+            "statistics": stats,
+            "period_hours": hours,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting statistics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/alerts', methods=['GET'])
+async def get_alerts():
+    """Get sensor readings that exceed normal thresholds"""
+    try:
+        hours = int(request.args.get('hours', 24))
+
+        cursor = collection_for(sensor_routes, 'alerts').find(
+            alerts_query(hours), **find_options('alerts')).sort("timestamp", -1).limit(50)
+        alerts = [sanitize_mongo_doc(add_alert_types(alert)) for alert in await cursor.to_list(None)]
+
+        return jsonify({
+            "alerts": alerts,
+            "count": len(alerts),
+            "thresholds": ALERT_THRESHOLDS,
+            "period_hours": hours,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting alerts: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/anomalies', methods=['GET'])
+async def get_anomalies():
+    """Get readings flagged by the writer's streaming anomaly detector"""
+    try:
+        node_id = request.args.get('node_id')
+        anomaly_type = request.args.get('type')
+        hours = int(request.args.get('hours', 24))
+        limit = int(request.args.get('limit', 100))
+
+        query = anomalies_query(node_id, anomaly_type, hours)
+        cursor = collection_for(sensor_routes, 'anomalies').find(
+            query, **find_options('anomalies')).sort("server_timestamp", -1).limit(limit)
+        anomalies = [sanitize_mongo_doc(r) for r in await cursor.to_list(None)]
+
+        return jsonify({
+            "anomalies": anomalies,
+            "count": len(anomalies),
+            "filters": {
+                "node_id": node_id,
+                "type": anomaly_type,
+                "hours": hours,
+                "limit": limit
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting anomalies: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+async def export_readings():
+    """Stream a node/time-range selection as compressed CSV or Parquet"""
+    try:
+        try:
+            params = exporter.parse_export_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        collection = collection_for(sensor_routes, 'export')
+        node_ids = params['node_ids']
+        if not node_ids:
+            # Every node, listed from the (node_id, timestamp) index so each
+            # slice is still an index range instead of a collection scan
+            node_ids = await collection.distinct(
+                'node_id', maxTimeMS=ENDPOINT_POLICIES['export']['max_time_ms'])
+
+        batches = exporter.aiter_batches(
+            collection, exporter.node_filter(node_ids), params['start_ts'], params['end_ts'],
+            slices=params['slices'], batch_size=params['batch_size'], find_kwargs=find_options('export')
+        )
+        body = exporter.aencode_stream(batches, params['format'], params['compression'])
+
+        async def generate():
+            try:
+                async for chunk in body:
+                    yield chunk
+            except Exception as e:
+                # Headers are already sent, the client sees a truncated file
+                logger.error(f"Error streaming export: {e}")
+                raise
+
+        # Quart cuts bodies off after RESPONSE_TIMEOUT (60 s); the cursor's
+        # maxTimeMS already bounds how long the export can run
+        response = Response(generate(), mimetype=params['mimetype'], headers={
+            "Content-Disposition": f"attachment; filename={params['filename']}"
+        })
+        response.timeout = None
+        return response
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error exporting readings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/commands', methods=['GET'])
+async def get_commands():
+    """Get the most recent irrigation commands with their state and latencies"""
+    try:
+        limit = int(request.args.get('limit', 20))
+
+        # Per-node detail is left out of the listing
+        cursor = collection_for(command_routes, 'commands').find(
+            {}, {"nodes": 0}, **find_options('commands')).sort("created_at", -1).limit(limit)
+        commands = await cursor.to_list(None)
+
+        return jsonify({
+            "commands": commands,
+            "count": len(commands),
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameter format"}), 400
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting commands: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/commands/<command_id>', methods=['GET'])
+async def get_command(command_id):
+    """Get one irrigation command, optionally with the state of every node"""
+    try:
+        include_nodes = request.args.get('include_nodes', 'false').lower() == 'true'
+        projection = None if include_nodes else {"nodes": 0}
+
+        command = await collection_for(command_routes, 'commands').find_one(
+            {"_id": command_id}, projection, **find_options('commands'))
+        if command is None:
+            return jsonify({"error": "Command not found"}), 404
+
+        return jsonify(command)
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error getting command: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/compare', methods=['GET'])
+async def compare_nodes():
+    """Compare several nodes on a common time grid, one range query per node"""
+    try:
+        try:
+            params = parse_compare_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        collection = collection_for(sensor_routes, 'compare')
+        sensors = params['sensors']
+
+        async def fetch(node_id):
+            # One indexed range scan per node instead of a single $in scan
+            cursor = collection.find(
+                compare_query(node_id, params['start_ts'], params['end_ts']),
+                compare_projection(sensors), **find_options('compare')
+            ).hint(NODE_TIMESTAMP_INDEX)
+            # Fold readings into the buckets as batches arrive, never the whole range
+            grid = GridAccumulator(sensors, params['start_ts'], params['step'], params['points'])
+            async for reading in cursor:
+                grid.add(reading)
+            return grid.result()
+
+        results = await asyncio.gather(*(fetch(node_id) for node_id in params['node_ids']))
+        columns = dict(zip(params['node_ids'], results))
+
+        return jsonify({
+            "grid": compare_grid(params['start_ts'], params['step'], params['points']),
+            "step_seconds": params['step'],
+            "sensors": sensors,
+            "columns": columns,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    except ExecutionTimeout as e:
+        return jsonify({"error": "Query exceeded its time limit"}), 504
+    except Exception as e:
+        logger.error(f"Error comparing nodes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,136 @@
+# Read routing against a local three-member replica set
+# Run with: python -m pytest test_read_routing.py  (skipped when mongod is not installed)
+import time
+import shutil
+import socket
+import subprocess
+from datetime import datetime
+import pytest
+from pymongo import MongoClient, monitoring
+from queries import (
+    DATABASE_NAME, SENSOR_COLLECTION, routed_collections, collection_for,
+    aggregate_options, find_options, last_values_pipeline, statistics_pipeline,
+    history_query
+)
+
+MONGOD = shutil.which("mongod")
+
+pytestmark = pytest.mark.skipif(MONGOD is None, reason="mongod is not installed")
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def _wait(condition, timeout=60, message="condition"):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if condition():
+                return
+        except Exception:
+            # Server not up yet or still electing
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Timed out waiting for {message}")
+
+class CommandRecorder(monitoring.CommandListener):
+    """Remembers which server ran each command"""
+
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append((event.command_name, event.connection_id))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def servers_for(self, command_name):
+        return {address for name, address in self.events if name == command_name}
+
+@pytest.fixture(scope="module")
+def replset(tmp_path_factory):
+    """Start rs0 on three free ports, seed a few readings and yield the member addresses"""
+    ports = [_free_port() for _ in range(3)]
+    processes = []
+    for port in ports:
+        dbpath = tmp_path_factory.mktemp(f"rs-{port}")
+        processes.append(subprocess.Popen(
+            [MONGOD, "--replSet", "rs0", "--port", str(port), "--bind_ip", "localhost",
+             "--dbpath", str(dbpath), "--logpath", str(dbpath / "mongod.log")],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+
+    try:
+        seed = MongoClient("localhost", ports[0], directConnection=True, serverSelectionTimeoutMS=1000)
+        _wait(lambda: seed.admin.command("ping"), message="mongod to start")
+        seed.admin.command("replSetInitiate", {
+            "_id": "rs0",
+            "members": [
+                {"_id": i, "host": f"localhost:{port}", "priority": 2 if i == 0 else 1}
+                for i, port in enumerate(ports)
+            ]
+        })
+        _wait(lambda: seed.admin.command("hello").get("isWritablePrimary"), message="a primary")
+        seed.close()
+
+        hosts = ",".join(f"localhost:{port}" for port in ports)
+        client = MongoClient(f"mongodb://{hosts}/?replicaSet=rs0&w=3")
+        now = time.time()
+        client[DATABASE_NAME][SENSOR_COLLECTION].insert_many([
+            {
+                "node_id": f"ESP32_{n:03d}",
+                "timestamp": now - minute * 60,
+                "server_timestamp": datetime.utcfromtimestamp(now - minute * 60),
+                "sensors": {"temperature": 22.0, "humidity": 60.0, "ph": 6.5, "gas": 500}
+            }
+            for n in range(5) for minute in range(30)
+        ])
+        client.close()
+
+        yield hosts
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+@pytest.fixture
+def reader_client(replset):
+    """Client configured like the reader API, recording which server runs each command"""
+    recorder = CommandRecorder()
+    client = MongoClient(f"mongodb://{replset}/?replicaSet=rs0", event_listeners=[recorder])
+    # max_staleness needs the secondaries' lag estimate, which takes a heartbeat
+    _wait(lambda: client.primary is not None and len(client.secondaries) == 2,
+          message="the client to discover the secondaries")
+    yield client, recorder
+    client.close()
+
+def test_last_values_reads_the_primary(reader_client):
+    client, recorder = reader_client
+    routes = routed_collections(client[DATABASE_NAME][SENSOR_COLLECTION])
+
+    readings = list(collection_for(routes, 'last_values').aggregate(
+        last_values_pipeline(), **aggregate_options('last_values')))
+
+    assert len(readings) == 5
+    assert recorder.servers_for("aggregate") == {client.primary}
+
+def test_analytics_read_a_secondary(reader_client):
+    client, recorder = reader_client
+    routes = routed_collections(client[DATABASE_NAME][SENSOR_COLLECTION])
+
+    stats = list(collection_for(routes, 'statistics').aggregate(
+        statistics_pipeline(None, 24), **aggregate_options('statistics')))
+    history = list(collection_for(routes, 'history').find(
+        history_query(None, 24), **find_options('history')).limit(10))
+
+    assert len(stats) == 5
+    assert len(history) == 10
+    servers = recorder.servers_for("aggregate") | recorder.servers_for("find")
+    assert servers
+    assert servers <= client.secondaries
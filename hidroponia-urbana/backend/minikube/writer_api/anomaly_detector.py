@@ -0,0 +1,178 @@
+# Streaming anomaly detector - per-node state kept in compact arrays
+import os
+import math
+import logging
+from array import array
+
+SENSORS = ("temperature", "humidity", "ph", "gas")
+
+# EWMA smoothing factor and z-score threshold
+ANOMALY_ALPHA = float(os.getenv('ANOMALY_ALPHA', 0.1))
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 4.0))
+# Readings needed before the z-score check is trusted
+ANOMALY_WARMUP = int(os.getenv('ANOMALY_WARMUP', 10))
+# Identical consecutive readings before a sensor is considered stuck
+ANOMALY_STUCK_COUNT = int(os.getenv('ANOMALY_STUCK_COUNT', 6))
+# Nodes per checkpoint document
+ANOMALY_CHUNK_SIZE = int(os.getenv('ANOMALY_CHUNK_SIZE', 2048))
+
+# Maximum plausible change per minute for each sensor
+MAX_RATE_PER_MINUTE = {
+    "temperature": 2.0,
+    "humidity": 10.0,
+    "ph": 0.5,
+    "gas": 200.0
+}
+
+logger = logging.getLogger(__name__)
+
+class StreamingAnomalyDetector:
+    """EWMA z-score, rate-of-change and stuck-sensor detection.
+
+    Every node gets an integer index; the statistics for node i and sensor j
+    live at position i * len(SENSORS) + j of flat typed arrays, so the
+    memory per node is constant and no database reads are needed per message.
+    """
+
+    def __init__(self, alpha=ANOMALY_ALPHA, z_threshold=ANOMALY_Z_THRESHOLD,
+                 warmup=ANOMALY_WARMUP, stuck_count=ANOMALY_STUCK_COUNT,
+                 chunk_size=ANOMALY_CHUNK_SIZE):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.stuck_count = stuck_count
+        self.chunk_size = chunk_size
+
+        self.node_index = {}
+        self.node_ids = []
+        self.mean = array('d')
+        self.var = array('d')
+        self.last_value = array('d')
+        self.count = array('L')
+        self.stuck = array('H')
+        self.last_ts = array('d')
+        self.dirty_chunks = set()
+
+    def _index_for(self, node_id):
+        """Return the array index of a node, allocating a slot if it is new"""
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.node_index[node_id] = idx
+            self.node_ids.append(node_id)
+            width = len(SENSORS)
+            self.mean.extend([0.0] * width)
+            self.var.extend([0.0] * width)
+            self.last_value.extend([math.nan] * width)
+            self.count.extend([0] * width)
+            self.stuck.extend([0] * width)
+            self.last_ts.append(0.0)
+        return idx
+
+    def update(self, node_id, timestamp, sensors):
+        """Feed one reading and return the list of anomalies it triggers"""
+        idx = self._index_for(node_id)
+        self.dirty_chunks.add(idx // self.chunk_size)
+
+        anomalies = []
+        prev_ts = self.last_ts[idx]
+        dt = timestamp - prev_ts if prev_ts > 0 else 0.0
+        base = idx * len(SENSORS)
+
+        for j, sensor in enumerate(SENSORS):
+            value = sensors.get(sensor)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            pos = base + j
+            last = self.last_value[pos]
+            n = self.count[pos]
+
+            # z-score against the EWMA before this reading is folded in
+            if n >= self.warmup and self.var[pos] > 0:
+                z = (value - self.mean[pos]) / math.sqrt(self.var[pos])
+                if abs(z) > self.z_threshold:
+                    anomalies.append({"sensor": sensor, "type": "zscore",
+                                      "value": value, "score": round(z, 2)})
+
+            if not math.isnan(last):
+                # Rate of change
+                if dt > 0:
+                    rate = abs(value - last) / dt * 60
+                    if rate > MAX_RATE_PER_MINUTE[sensor]:
+                        anomalies.append({"sensor": sensor, "type": "rate",
+                                          "value": value, "score": round(rate, 2)})
+
+                # Stuck sensor
+                if value == last:
+                    if self.stuck[pos] < 0xFFFF:
+                        self.stuck[pos] += 1
+                else:
+                    self.stuck[pos] = 0
+                if self.stuck[pos] >= self.stuck_count:
+                    anomalies.append({"sensor": sensor, "type": "stuck",
+                                      "value": value, "score": self.stuck[pos]})
+
+            # Update EWMA mean and variance
+            if n == 0:
+                self.mean[pos] = value
+                self.var[pos] = 0.0
+            else:
+                diff = value - self.mean[pos]
+                incr = self.alpha * diff
+                self.mean[pos] += incr
+                self.var[pos] = (1 - self.alpha) * (self.var[pos] + diff * incr)
+            self.last_value[pos] = value
+            self.count[pos] = n + 1
+
+        if timestamp > prev_ts:
+            self.last_ts[idx] = timestamp
+        return anomalies
+
+    def dump_chunks(self, only_dirty=True):
+        """Serialize state into checkpoint documents, one per chunk of nodes"""
+        width = len(SENSORS)
+        if only_dirty:
+            chunks = sorted(self.dirty_chunks)
+        else:
+            chunks = range((len(self.node_ids) + self.chunk_size - 1) // self.chunk_size)
+
+        docs = []
+        for chunk in chunks:
+            start = chunk * self.chunk_size
+            end = min(start + self.chunk_size, len(self.node_ids))
+            lo, hi = start * width, end * width
+            docs.append({
+                "_id": f"chunk-{chunk}",
+                "nodes": self.node_ids[start:end],
+                "mean": self.mean[lo:hi].tobytes(),
+                "var": self.var[lo:hi].tobytes(),
+                "last_value": self.last_value[lo:hi].tobytes(),
+                "count": self.count[lo:hi].tobytes(),
+                "stuck": self.stuck[lo:hi].tobytes(),
+                "last_ts": self.last_ts[start:end].tobytes()
+            })
+        self.dirty_chunks.clear()
+        return docs
+
+    def load_chunks(self, docs):
+        """Restore state from checkpoint documents produced by dump_chunks"""
+        for doc in sorted(docs, key=lambda d: int(d["_id"].split("-")[1])):
+            fields = {}
+            for name in ("mean", "var", "last_value", "count", "stuck", "last_ts"):
+                arr = array(getattr(self, name).typecode)
+                arr.frombytes(bytes(doc[name]))
+                fields[name] = arr
+
+            width = len(SENSORS)
+            for i, node_id in enumerate(doc["nodes"]):
+                idx = self._index_for(node_id)
+                self.last_ts[idx] = fields["last_ts"][i]
+                for j in range(width):
+                    src, dst = i * width + j, idx * width + j
+                    self.mean[dst] = fields["mean"][src]
+                    self.var[dst] = fields["var"][src]
+                    self.last_value[dst] = fields["last_value"][src]
+                    self.count[dst] = fields["count"][src]
+                    self.stuck[dst] = fields["stuck"][src]
+        self.dirty_chunks.clear()
+        logger.info(f"Restored anomaly state for {len(self.node_ids)} nodes")
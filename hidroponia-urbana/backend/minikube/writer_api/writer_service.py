@@ -2,11 +2,14 @@
 import os
 import json
 import time
+import signal
 import logging
+import threading
 from datetime import datetime
 import paho.mqtt.client as mqtt
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+from anomaly_detector import StreamingAnomalyDetector
 
 # Configuration
 #MQTT_BROKER = "localhost"
@@ -17,9 +20,13 @@ MQTT_TOPICS = ["sensor/data/#", "status/#"]
 
 #MONGODB_URI = "mongodb://localhost:27017/"
 MONGODB_URI = os.getenv('MONGODB_URI')
-DATABASE_NAME = "hydroponics"
+# Replays (esp32/mqtt_traffic.py) point this at a separate database
+DATABASE_NAME = os.getenv('MONGODB_DATABASE', 'hydroponics')
 SENSOR_COLLECTION = "sensor_readings"
 STATUS_COLLECTION = "node_status"
+ANOMALY_STATE_COLLECTION = "anomaly_state"
+# Seconds between anomaly detector checkpoints; 0 disables them
+ANOMALY_CHECKPOINT_INTERVAL = int(os.getenv('ANOMALY_CHECKPOINT_INTERVAL', 60))
 
 # Setup logging
 logging.basicConfig(
@@ -35,6 +42,12 @@ class MQTTWriterService:
         self.db = None
         self.sensor_collection = None
         self.status_collection = None
+        self.anomaly_state_collection = None
+        self.detector = StreamingAnomalyDetector()
+        # Guards the detector arrays: updated by the MQTT thread, copied by checkpoints
+        self.detector_lock = threading.Lock()
+        self.stop_checkpoints = threading.Event()
+        self.checkpoint_thread = None
         
     def connect_mongodb(self):
         """Connect to MongoDB database"""
@@ -46,10 +59,19 @@ class MQTTWriterService:
             self.db = self.mongo_client[DATABASE_NAME]
             self.sensor_collection = self.db[SENSOR_COLLECTION]
             self.status_collection = self.db[STATUS_COLLECTION]
+            self.anomaly_state_collection = self.db[ANOMALY_STATE_COLLECTION]
             
             # Create indexes for better query performance
             self.sensor_collection.create_index([("node_id", 1), ("timestamp", -1)])
             self.status_collection.create_index([("node_id", 1), ("timestamp", -1)])
+            # Only flagged readings are indexed for the anomalies endpoint
+            self.sensor_collection.create_index(
+                [("anomaly", 1), ("server_timestamp", -1)],
+                partialFilterExpression={"anomaly": True}
+            )
+            
+            # Restore detector state from the last checkpoint
+            self.detector.load_chunks(list(self.anomaly_state_collection.find()))
             
             logger.info("Connected to MongoDB successfully")
             return True
@@ -101,6 +123,24 @@ class MQTTWriterService:
                 logger.error(f"Missing required fields in sensor data: {data}")
                 return
             
+            # Windowed summaries carry min/max/mean per sensor; "sensors" holds the means
+            if data.get('type') == 'summary':
+                if not isinstance(data.get('summary'), dict) or not isinstance(data.get('window'), dict):
+                    logger.error(f"Malformed summary message: {data}")
+                    return
+                data['window']['samples'] = int(data['window'].get('samples', 1))
+            
+            # Flag anomalies using the in-memory per-node state
+            ts = data['timestamp']
+            if not isinstance(ts, (int, float)):
+                ts = data['processed_at']
+            with self.detector_lock:
+                anomalies = self.detector.update(data['node_id'], float(ts), data['sensors'])
+            if anomalies:
+                data['anomaly'] = True
+                data['anomalies'] = anomalies
+                logger.warning(f"Anomalies detected for node {data['node_id']}: {anomalies}")
+            
             # Insert into MongoDB
             result = self.sensor_collection.insert_one(data)
             logger.info(f"Stored sensor data from node {data['node_id']} with ID: {result.inserted_id}")
@@ -110,6 +150,34 @@ class MQTTWriterService:
         except Exception as e:
             logger.error(f"Unexpected error storing sensor data: {e}")
     
+    def checkpoint_anomaly_state(self):
+        """Persist the chunks of detector state touched since the last checkpoint"""
+        # dump_chunks copies the arrays, so only the copy is held under the lock
+        # and ingestion continues while the chunks are written
+        with self.detector_lock:
+            docs = self.detector.dump_chunks()
+        try:
+            for doc in docs:
+                self.anomaly_state_collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            if docs:
+                logger.info(f"Checkpointed anomaly state ({len(docs)} chunks)")
+        except PyMongoError as e:
+            logger.error(f"Failed to checkpoint anomaly state: {e}")
+            # Keep the chunks dirty so the next checkpoint retries them
+            with self.detector_lock:
+                self.detector.dirty_chunks.update(int(doc["_id"].split("-")[1]) for doc in docs)
+    
+    def checkpoint_loop(self):
+        """Checkpoint every ANOMALY_CHECKPOINT_INTERVAL seconds off the MQTT thread"""
+        while not self.stop_checkpoints.wait(ANOMALY_CHECKPOINT_INTERVAL):
+            self.checkpoint_anomaly_state()
+    
+    def handle_sigterm(self, signum, frame):
+        """Kubernetes stops pods with SIGTERM; leave loop_forever so the final checkpoint runs"""
+        logger.info("Received SIGTERM, shutting down writer service...")
+        if self.mqtt_client:
+            self.mqtt_client.disconnect()
+    
     def store_status_data(self, data):
         """Store node status data in MongoDB"""
         try:
@@ -156,6 +224,11 @@ class MQTTWriterService:
         
         logger.info("Writer service started successfully")
         
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        if ANOMALY_CHECKPOINT_INTERVAL > 0:
+            self.checkpoint_thread = threading.Thread(target=self.checkpoint_loop, daemon=True)
+            self.checkpoint_thread.start()
+        
         try:
             # Start MQTT loop
             self.mqtt_client.loop_forever()
@@ -166,7 +239,11 @@ class MQTTWriterService:
         finally:
             if self.mqtt_client:
                 self.mqtt_client.disconnect()
+            if self.checkpoint_thread:
+                self.stop_checkpoints.set()
+                self.checkpoint_thread.join()
             if self.mongo_client:
+                self.checkpoint_anomaly_state()
                 self.mongo_client.close()
 
 def main():